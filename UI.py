@@ -1,6 +1,6 @@
 # ui.py
 import gradio as gr
-from backend import gemini_chat_wrapper   # Import the function from backend.py
+from backend import gemini_chat_wrapper, load_pregenerated_answers, start_answer_reload   # Import the functions from backend.py
 
 # -------------------------------
 # Gradio Chat Interface
@@ -19,4 +19,6 @@ demo = gr.ChatInterface(
 # -------------------------------
 # share=True -> generates a public link via Gradio’s servers (useful for testing/demo)
 if __name__ == "__main__":
+    load_pregenerated_answers()  # Answers pre-generated by warm_cache.py
+    start_answer_reload()        # ...and any later warm_cache.py run
     demo.launch(share=True)
@@ -0,0 +1,147 @@
+# admission.py
+# Admission control for /chat: per-user rate limits and bounded execution lanes.
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from logger import get_logger
+from rate_limit import TokenBucket
+
+logger = get_logger(__name__)
+
+# ---------- General settings ----------
+USER_RATE_PER_MIN = float(os.getenv("CHAT_USER_RATE_PER_MIN", "20"))   # sustained requests per user
+USER_BURST = float(os.getenv("CHAT_USER_BURST", "5"))
+MAX_TRACKED_USERS = int(os.getenv("CHAT_MAX_TRACKED_USERS", "10000"))
+LLM_MAX_INFLIGHT = int(os.getenv("CHAT_LLM_MAX_INFLIGHT", "16"))         # concurrent Gemini calls
+LLM_MAX_QUEUED = int(os.getenv("CHAT_LLM_MAX_QUEUED", "16"))             # waiting beyond that, then shed
+FAST_MAX_INFLIGHT = int(os.getenv("CHAT_FAST_MAX_INFLIGHT", "32"))       # cache hits / DB-only answers
+FAST_MAX_QUEUED = int(os.getenv("CHAT_FAST_MAX_QUEUED", "256"))
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is shed. `status` is 429 for per-user limits
+    and 503 for global capacity; `retry_after` is in whole seconds.
+    """
+    def __init__(self, reason: str, retry_after: int, status: int = 503):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status = status
+
+
+class Lane:
+    """
+    A bounded execution lane: a dedicated thread pool with `max_inflight`
+    workers plus at most `max_queued` waiting requests. Anything beyond
+    that is rejected immediately instead of piling up.
+    """
+    def __init__(self, name: str, max_inflight: int, max_queued: int):
+        self.name = name
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.pool = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix=f"{name}-lane")
+        self._lock = threading.Lock()
+        self.active = 0          # admitted and not finished (running + queued)
+        self.admitted = 0
+        self.shed = 0
+        self.avg_latency = 1.0   # EWMA seconds, used for Retry-After
+
+    def _acquire(self):
+        with self._lock:
+            if self.active >= self.max_inflight + self.max_queued:
+                self.shed += 1
+                queued = self.active - self.max_inflight
+                retry_after = max(1, math.ceil(self.avg_latency * (1 + queued / self.max_inflight)))
+                raise Overloaded(f"{self.name} lane is full", retry_after=retry_after, status=503)
+            self.active += 1
+            self.admitted += 1
+
+    def _release(self, start: float):
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self.active -= 1
+            self.avg_latency = 0.9 * self.avg_latency + 0.1 * elapsed
+
+    async def run(self, fn, *args):
+        """
+        Run `fn(*args)` on this lane's pool, keeping the caller's contextvars
+        (request id) and shedding if the lane is full.
+
+        The slot is released when the pool work finishes (or is cancelled
+        before it starts), not when the awaiting task ends: a cancelled
+        request (e.g. client disconnect) leaves its thread running, and that
+        thread still counts against the lane.
+        """
+        self._acquire()
+        start = time.monotonic()
+        ctx = contextvars.copy_context()
+        try:
+            future = self.pool.submit(ctx.run, fn, *args)
+        except BaseException:
+            self._release(start)
+            raise
+        future.add_done_callback(lambda _: self._release(start))
+        return await asyncio.wrap_future(future)
+
+    def metrics(self) -> dict:
+        return {
+            "inflight": min(self.active, self.max_inflight),
+            "queue_depth": max(0, self.active - self.max_inflight),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "avg_latency_s": round(self.avg_latency, 3),
+        }
+
+
+class AdmissionController:
+    """
+    Per-user token buckets in front of two lanes: `fast` for answers that
+    need no LLM call and `llm` for Gemini-bound work, so a slow Gemini
+    can't starve cache hits of threads.
+    """
+    def __init__(self, user_rate_per_min: float = USER_RATE_PER_MIN, user_burst: float = USER_BURST,
+                 llm_max_inflight: int = LLM_MAX_INFLIGHT, llm_max_queued: int = LLM_MAX_QUEUED,
+                 fast_max_inflight: int = FAST_MAX_INFLIGHT, fast_max_queued: int = FAST_MAX_QUEUED,
+                 max_tracked_users: int = MAX_TRACKED_USERS):
+        self.user_rate = user_rate_per_min / 60
+        self.user_burst = user_burst
+        self.max_tracked_users = max_tracked_users
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rate_limited = 0
+        self.fast = Lane("fast", fast_max_inflight, fast_max_queued)
+        self.llm = Lane("llm", llm_max_inflight, llm_max_queued)
+
+    def admit_user(self, user_id: str):
+        """
+        Charge one request to `user_id`; raise Overloaded(429) when over the limit.
+        """
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = TokenBucket(self.user_rate, self.user_burst)
+                self._buckets[user_id] = bucket
+                if len(self._buckets) > self.max_tracked_users:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(user_id)
+        if not bucket.try_acquire():
+            with self._lock:
+                self.rate_limited += 1
+            logger.info("chat rate limited", extra={"user": user_id})
+            raise Overloaded("rate limit exceeded", retry_after=max(1, math.ceil(bucket.wait_time())), status=429)
+
+    def metrics(self) -> dict:
+        return {
+            "rate_limited": self.rate_limited,
+            "tracked_users": len(self._buckets),
+            "fast": self.fast.metrics(),
+            "llm": self.llm.metrics(),
+        }
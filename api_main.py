@@ -1,11 +1,54 @@
-from fastapi import FastAPI
+import asyncio
+import uuid
+from fastapi import FastAPI, HTTPException, Request, Response, Query
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import List, Dict
-from backend import gemini_chat_wrapper  # Import wrapper function from backend.py
+from typing import List, Dict, Optional
+from backend import prepare_answer, complete_answer, load_pregenerated_answers, start_answer_reload, cache, semantic_cache  # Import answer pipeline from backend.py
+from admission import AdmissionController, Overloaded
+from write_queue import write_queue
+from catalog import get_drugs_page, catalog_version, InvalidQuery, DEFAULT_LIMIT, MAX_LIMIT
+from logger import set_request_id, reset_request_id, request_id_var, logging_stats
+from profiling import (SamplingProfiler, request_profiler, is_authorized, start_tracemalloc, stop_tracemalloc,
+                       memory_report, MAX_WINDOW_S)
 
 # Initialize FastAPI app
 app = FastAPI(title="SafeMeds RAG Chatbot API", version="1.0")
 
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """
+    Bind a request id (from X-Request-ID or a fresh one) to every log record
+    emitted while handling the request, and echo it back in the response.
+    """
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = set_request_id(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        reset_request_id(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+@app.on_event("startup")
+def warm_caches():
+    """
+    Serve answers pre-generated by warm_cache.py from the first request,
+    and pick up later warm_cache.py runs without a restart.
+    """
+    load_pregenerated_answers()
+    start_answer_reload()
+
+
+@app.on_event("shutdown")
+def flush_writes():
+    """
+    Commit and embed any add-drug requests still in the write queue.
+    """
+    write_queue.stop()
+
+
 # ======================
 #   Data Models
 # ======================
@@ -19,6 +62,12 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     citations: List[str] = []
+    cache_entry_id: Optional[int] = None  # set when served from the semantic cache
+
+# Feedback on an answer served from the semantic cache
+class CacheFeedback(BaseModel):
+    user_id: str
+    cache_entry_id: int
 
 # Schema for storing chat history (role + message)
 class ChatHistoryItem(BaseModel):
@@ -28,25 +77,66 @@ class ChatHistoryItem(BaseModel):
 # In-memory storage for chat history per user
 chat_histories: Dict[str, List[ChatHistoryItem]] = {}
 
+# Per-user rate limits + separate fast / LLM lanes
+admission = AdmissionController()
+
+# New drugs from the write queue change /drugs pages: don't wait for the version TTL
+write_queue.on_inserted.append(lambda entries: catalog_version.bump())
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """
+    Shed load early with 429 (per-user limit) or 503 (capacity) and a Retry-After hint.
+    """
+    return JSONResponse(
+        status_code=exc.status,
+        content={"detail": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # ======================
 #   API Endpoints
 # ======================
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request, response: Response):
     """
     Chat endpoint:
+    - Applies the per-user rate limit
     - Stores user query in history
-    - Calls backend Gemini wrapper for answer
+    - Answers from cache / DB on the fast lane, or calls Gemini on the LLM lane
     - Stores assistant response in history
-    - Returns answer with citations
+    - Returns answer with citations (and cache_entry_id for semantic-cache hits, see /chat/feedback)
+    - `X-Profile: <PROFILING_TOKEN>` profiles this request (artifact path in X-Profile-Artifact)
     """
+    admission.admit_user(request.user_id)
+    profiler = request_profiler(http_request.headers.get("X-Profile"))
+    prepare, complete = prepare_answer, complete_answer
+    if profiler:
+        prepare, complete = profiler.track(prepare_answer), profiler.track(complete_answer)
+
     # Get old history or create a new one
     history = chat_histories.setdefault(request.user_id, [])
-    history.append(ChatHistoryItem(role="user", message=request.query))
+    user_item = ChatHistoryItem(role="user", message=request.query)
+    history.append(user_item)
 
-    # Call Gemini wrapper + database search
-    answer = gemini_chat_wrapper(request.query, history=[h.dict() for h in history])
+    try:
+        # Cache + database search (cheap, never waits behind Gemini)
+        prepared = await admission.fast.run(prepare, request.query, [h.dict() for h in history])
+        # Gemini call only when nothing above answered the question
+        if prepared.answer is None:
+            answer = await admission.llm.run(complete, prepared)
+        else:
+            answer = prepared.answer
+    except Overloaded:
+        # Shed requests leave no trace in the history
+        history[:] = [h for h in history if h is not user_item]
+        raise
+    finally:
+        if profiler:
+            response.headers["X-Profile-Artifact"] = await asyncio.to_thread(
+                profiler.finish, f"chat-{request_id_var.get()}")
 
     # Placeholder for sources (can extend if backend provides citations)
     citations = ["[SafeMeds DB]"]
@@ -54,7 +144,20 @@ def chat(request: ChatRequest):
     # Save assistant reply in history
     history.append(ChatHistoryItem(role="assistant", message=answer))
 
-    return ChatResponse(answer=answer, citations=citations)
+    return ChatResponse(answer=answer, citations=citations, cache_entry_id=prepared.cache_entry_id)
+
+
+@app.post("/chat/feedback")
+def report_wrong_cached_answer(feedback: CacheFeedback):
+    """
+    Report that an answer served from the semantic cache (cache_entry_id in
+    the /chat response) did not fit the question: evicts it and counts a
+    false hit in /metrics.
+    """
+    admission.admit_user(feedback.user_id)
+    if not semantic_cache.report_false_hit(feedback.cache_entry_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired cache entry")
+    return {"evicted": feedback.cache_entry_id}
 
 
 @app.get("/chat/history/{user_id}", response_model=List[ChatHistoryItem])
@@ -63,3 +166,121 @@ def get_history(user_id: str):
     Get chat history for a specific user_id
     """
     return chat_histories.get(user_id, [])
+
+
+@app.get("/drugs")
+def list_drugs(
+    request: Request,
+    response: Response,
+    status_after_sleeve: Optional[str] = None,
+    drug_class: Optional[str] = None,
+    administration_form: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return (id is always included)"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+):
+    """
+    Browse the catalog with filters, field projection and keyset pagination.
+    Supports If-None-Match: unchanged pages return 304 without touching the DB.
+    """
+    try:
+        etag, body = get_drugs_page(
+            {"status_after_sleeve": status_after_sleeve, "drug_class": drug_class,
+             "administration_form": administration_form},
+            fields=fields, cursor=cursor, limit=limit,
+            if_none_match=request.headers.get("If-None-Match"),
+        )
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=0, must-revalidate"}
+    if body is None:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return body
+
+
+@app.get("/drugs/ingest/{ingest_id}")
+def get_ingest_status(ingest_id: str):
+    """
+    Poll an add-drug request: queued -> inserted -> indexed (or duplicate / failed)
+    Statuses are per process (see write_queue.py): requires a single API worker.
+    """
+    status = write_queue.status(ingest_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown ingest id")
+    return status
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Admission metrics (in-flight / queue depth / shed counts per lane),
+    semantic cache hit / false-hit rates and logging queue depth / dropped records
+    """
+    report = admission.metrics()
+    report["semantic_cache"] = semantic_cache.stats()
+    report["logging"] = logging_stats()
+    return report
+
+
+# ======================
+#   Admin: profiling
+# ======================
+
+def require_admin(token: Optional[str]):
+    # Hidden entirely unless PROFILING_TOKEN is configured and presented
+    if not is_authorized(token):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@app.post("/admin/profile")
+async def profile_window(http_request: Request, seconds: float = Query(10, gt=0, le=MAX_WINDOW_S)):
+    """
+    Sample every thread for `seconds` and write a collapsed-stack artifact
+    """
+    require_admin(http_request.headers.get("X-Admin-Token"))
+    profiler = SamplingProfiler().start()
+    await asyncio.sleep(seconds)
+    path = await asyncio.to_thread(profiler.finish, "window")
+    return {"artifact": path, "samples": profiler.samples, "top": profiler.top(15)}
+
+
+@app.post("/admin/memory/{action}")
+def toggle_tracemalloc(action: str, http_request: Request):
+    """
+    Start / stop tracemalloc (it slows allocations, so it's off by default)
+    """
+    require_admin(http_request.headers.get("X-Admin-Token"))
+    if action == "start":
+        start_tracemalloc()
+    elif action == "stop":
+        stop_tracemalloc()
+    else:
+        raise HTTPException(status_code=400, detail="action must be 'start' or 'stop'")
+    return {"tracing": action == "start"}
+
+
+@app.post("/admin/answers/reload")
+def reload_answers(http_request: Request):
+    """
+    Load answers warm_cache.py wrote since the last load, without waiting for the poll
+    """
+    require_admin(http_request.headers.get("X-Admin-Token"))
+    return {"loaded": load_pregenerated_answers()}
+
+
+@app.get("/admin/memory")
+def get_memory_report(http_request: Request, top: int = Query(20, ge=1, le=200)):
+    """
+    tracemalloc top-N sites and growth since the last call, plus in-memory store sizes
+    """
+    require_admin(http_request.headers.get("X-Admin-Token"))
+    report = memory_report(top)
+    report["stores"] = {
+        "chat_histories_users": len(chat_histories),
+        "chat_histories_messages": sum(len(h) for h in chat_histories.values()),
+        "simple_cache_entries": len(cache.cache),
+        "semantic_cache_entries": semantic_cache.stats()["entries"],
+    }
+    return report
@@ -1,11 +1,23 @@
 import os
 import requests
 import time
-import logging
 import hashlib
-from typing import Dict, List
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
 from prompting import prompt_config   # Importing prompt configuration file
-from db import search_drug, insert_drug   # Import DB functions
+from db import search_drug, get_embeddings, list_drugs, load_cached_answers, get_answer_cache_version   # Import DB functions
+from semantic_cache import SemanticCache, context_fingerprint
+from chunk_store import sync_chunks, store as chunk_store
+from symptom_kb import kb as symptom_kb
+from logger import setup_logging, get_logger
+from write_queue import write_queue, WriteQueueFull
+
+# ======================
+#   Logging
+# ======================
+setup_logging()
+logger = get_logger(__name__)
 
 # ======================
 #   Gemini API Settings
@@ -17,45 +29,56 @@ url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash
 #   Simple Cache Layer
 # ======================
 class SimpleCache:
+    """
+    Exact-question cache. Each answer remembers the drug ids and the context
+    fingerprint it was generated from; a lookup with a different fingerprint
+    (the meds row changed) is a miss and drops the entry.
+    """
     def __init__(self):
-        self.cache: Dict[str, str] = {}
+        self.cache: Dict[str, Tuple[str, Tuple, Optional[str]]] = {}
 
     def _hash(self, query: str) -> str:
         return hashlib.md5(query.lower().encode()).hexdigest()
 
-    def get(self, query: str):
+    def get(self, query: str, fingerprint: Optional[str] = None):
         key = self._hash(query)
-        return self.cache.get(key)
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        response, _, stored_fingerprint = entry
+        if fingerprint is not None and stored_fingerprint != fingerprint:
+            self.cache.pop(key, None)
+            return None
+        return response
 
-    def set(self, query: str, response: str):
+    def set(self, query: str, response: str, scope: Tuple = (), fingerprint: Optional[str] = None):
         key = self._hash(query)
-        self.cache[key] = response
+        self.cache[key] = (response, scope, fingerprint)
+
+    def invalidate_scope(self, scope: Tuple) -> int:
+        doomed = [key for key, (_, entry_scope, _) in list(self.cache.items()) if entry_scope == scope]
+        for key in doomed:
+            self.cache.pop(key, None)
+        return len(doomed)
 
 cache = SimpleCache()
 
+# Paraphrase-tolerant cache in front of the LLM call, scoped by retrieved drug ids
+semantic_cache = SemanticCache(embed_fn=lambda text: get_embeddings([text])[0])
+
 # ======================
-#   Symptom Keywords
+#   Symptom Knowledge Base
 # ======================
-SYMPTOMS_KEYWORDS = {
-    "وجع المعدة": ["وجع", "بطن", "معدة", "حرقة", "ألم في البطن"],
-    "صداع": ["صداع", "راس وجع", "وجع راس"],
-    "قيء": ["ترجيع", "سخنية", "غثيان"],
-    "إسهال": ["اسهال", "إسهال", "إسهال مائي"],
-    "تعب": ["تعب", "ارهاق", "ضعف"],
-    "تنميل": ["تنميل", "وخز", "خدر"],
-}
+# Keywords, symptom -> drug mappings and their context blocks live in the DB
+# (symptom_kb.py) and are served from an in-memory snapshot, reloaded on change.
+symptom_kb.start_auto_reload()
 
 # ======================
-#   Mapping Symptoms ↔ Drugs
+#   Retrieval Chunk Store
 # ======================
-SYMPTOM_TO_DRUG = {
-    "وجع المعدة": ["Omeprazole", "Pantoprazole", "Ranitidine"],
-    "صداع": ["Paracetamol", "Ibuprofen", "Aspirin"],
-    "قيء": ["Metoclopramide", "Domperidone"],
-    "إسهال": ["Loperamide", "Oral Rehydration Salt"],
-    "تعب": ["Multivitamins", "Iron Supplement", "Vitamin B Complex"],
-    "تنميل": ["Vitamin B Complex", "Magnesium"]
-}
+# Per-drug / per-field chunks (chunk_store.py): re-synced when meds rows
+# change (catalog_version), reloaded when another process rewrites them.
+chunk_store.start_auto_reload()
 
 # ======================
 #   Add drug from text
@@ -98,39 +121,39 @@ def add_drug_from_text(message: str):
         if not entry["drug_name"] or not entry["indication"]:
             return "⚠️ لازم تكتب على الأقل اسم الدواء ولازمته عشان اقدر أضيفه."
 
-        insert_drug(entry)
-        return f"✅ تمت إضافة الدواء '{entry['drug_name']}' بنجاح!"
+        ingest_id = write_queue.submit(entry)
+        return f"✅ استلمنا طلب إضافة الدواء '{entry['drug_name']}' وهيتضاف خلال ثواني. رقم المتابعة: {ingest_id}"
+    except WriteQueueFull:
+        return "⏳ فيه طلبات إضافة كتير دلوقتي، جرب تاني بعد شوية."
     except Exception as e:
         return f"❌ حصل خطأ أثناء الإضافة: {e}"
 
+def refresh_caches_for_new_drugs(entries: List[dict]):
+    """
+    Called by the write queue once new drugs are committed: "no match"
+    answers (scope `()`) may have been about one of them, so they are
+    dropped from the exact cache. The semantic cache never holds them.
+    """
+    dropped = cache.invalidate_scope(())
+    logger.info("caches refreshed for new drugs", extra={"drugs": len(entries), "dropped": dropped})
+
+write_queue.on_inserted.append(refresh_caches_for_new_drugs)
+# Materialize retrieval chunks for the new rows
+write_queue.on_inserted.append(lambda entries: sync_chunks([e["id"] for e in entries]))
+# New drugs may complete a symptom's drug list
+write_queue.on_inserted.append(lambda entries: symptom_kb.refresh_if_changed())
+
 # ======================
 #   Match Symptom
 # ======================
 def match_symptom(user_input: str):
-    user_input = user_input.lower()
-    for symptom, keywords in SYMPTOMS_KEYWORDS.items():
-        for kw in keywords:
-            if kw in user_input:
-                return symptom
-    return None
+    return symptom_kb.current.match(user_input)
 
 # ======================
-#   Main Chat Wrapper
+#   Prompt Building
 # ======================
-def gemini_chat_wrapper(message: str, history: List = []):
-    # 0️⃣ Check if user wants to add a drug
-    if "اضيف" in message or "أدخل" in message or "اضافة" in message:
-        return add_drug_from_text(message)
-
-    # 1️⃣ Cache lookup
-    cached = cache.get(message)
-    if cached:
-        return cached
-
-    # 2️⃣ DB search
-    drug_info = search_drug(message)
-    if drug_info:
-        relevant_context = f"""
+def build_drug_context(drug_info: dict) -> str:
+    return f"""
 اسم الدواء: {drug_info['drug_name']}
 الاسم العلمي: {drug_info['generic_name']}
 الفئة الدوائية: {drug_info['drug_class']}
@@ -141,29 +164,14 @@ def gemini_chat_wrapper(message: str, history: List = []):
 شكل الدواء: {drug_info.get('administration_form', 'غير محدد')}
 ملاحظات عامة: {drug_info.get('notes', 'لا توجد')}
 """
-    else:
-        # 3️⃣ Symptom mapping
-        symptom = match_symptom(message)
-        if symptom:
-            meds_list = SYMPTOM_TO_DRUG.get(symptom, [])
-            meds_info = []
-            for med in meds_list:
-                info = search_drug(med)
-                if info:
-                    meds_info.append(f"{info['drug_name']} ({info['generic_name']}): {info['indication']}")
-            if meds_info:
-                relevant_context = f"Regarding {symptom}, suitable medications:\n- " + "\n- ".join(meds_info)
-            else:
-                relevant_context = f"It seems you have {symptom}. Try resting, stay hydrated, and consult a doctor if symptoms persist."
-        else:
-            relevant_context = "❌ No direct match found for this drug or symptom in the database."
 
+def build_prompt(message: str, relevant_context: str, history: List = []) -> str:
     history_text = "\n".join([
         f"{h['role']}: {h['message']}" if isinstance(h, dict) else f"{h[0]}: {h[1]}"
         for h in history
     ])
 
-    final_prompt = f"""
+    return f"""
 {prompt_config['instructions']}
 
 HISTORY:
@@ -176,33 +184,199 @@ QUESTION:
 {message}
 """
 
-    payload = {"contents": [{"parts": [{"text": final_prompt}]}]}
+# ======================
+#   Gemini Call
+# ======================
+def call_gemini(prompt: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Send one prompt to Gemini. Returns (answer, None) on success
+    or (None, user-facing error message) on failure.
+    """
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
 
+    start = time.perf_counter()
     try:
         response = requests.post(url, json=payload, timeout=15)
     except requests.exceptions.RequestException as e:
-        return f"❌ Network error: {e}"
+        logger.error("gemini request failed: %s", e)
+        return None, f"❌ Network error: {e}"
+    logger.info("gemini call", extra={"status": response.status_code,
+                                      "latency_ms": round((time.perf_counter() - start) * 1000, 1)})
 
     if response.status_code == 200:
         data = response.json()
         try:
-            answer = data["candidates"][0]["content"]["parts"][0]["text"]
-            cache.set(message, answer)
-            return answer
+            return data["candidates"][0]["content"]["parts"][0]["text"], None
         except Exception as e:
-            return f"⚠️ Unexpected response format: {e}\n{data}"
+            return None, f"⚠️ Unexpected response format: {e}\n{data}"
     else:
-        return f"❌ Error: {response.status_code} - {response.text}"
+        return None, f"❌ Error: {response.status_code} - {response.text}"
 
 # ======================
-#   Logging
+#   Pre-generated Answers
 # ======================
-logging.basicConfig(level=logging.INFO)
+ANSWER_RELOAD_INTERVAL_S = float(os.getenv("ANSWER_CACHE_RELOAD_S", "30"))
+
+# (drug_id, intent) -> (fingerprint, version, answer) already put in the caches,
+# so reloads only add rows warm_cache.py wrote since (the semantic cache appends).
+_loaded_answers: Dict[Tuple[int, str], Tuple[str, str, str]] = {}
+_answers_version = None
+_answers_lock = threading.Lock()
+_answers_thread = None
+
+def load_pregenerated_answers() -> int:
+    """
+    Fill the exact and semantic caches from answers written by warm_cache.py.
+    Rows generated from an older version of the drug (fingerprint no longer
+    matches its current context) are skipped until warm_cache.py runs again;
+    rows already loaded are skipped too, so this is safe to call repeatedly.
+    Failures are logged and the caches stay as they were.
+    """
+    global _answers_version
+    with _answers_lock:
+        try:
+            version = get_answer_cache_version()
+            rows = load_cached_answers()
+            current = {d["id"]: context_fingerprint(build_drug_context(d)) for d in list_drugs()}
+        except Exception as e:
+            logger.warning("could not load pre-generated answers: %s", e)
+            return 0
+        fresh = [row for row in rows if current.get(row["drug_id"]) == row["fingerprint"]]
+        added = 0
+        for row in fresh:
+            key = (row["drug_id"], row["intent"])
+            loaded = (row["fingerprint"], row["version"], row["answer"])
+            if _loaded_answers.get(key) == loaded:
+                continue
+            cache.set(row["question"], row["answer"], (row["drug_id"],), row["fingerprint"])
+            semantic_cache.set(row["question"], row["answer"], (row["drug_id"],), row["fingerprint"])
+            _loaded_answers[key] = loaded
+            added += 1
+        _answers_version = version
+    logger.info("pre-generated answers loaded", extra={"count": added, "stale": len(rows) - len(fresh)})
+    return added
+
+def refresh_pregenerated_answers_if_changed() -> int:
+    """
+    Cheap version check on answer_cache; reloads only after warm_cache.py wrote.
+    """
+    try:
+        version = get_answer_cache_version()
+    except Exception as e:
+        logger.warning("answer cache version check failed: %s", e)
+        return 0
+    if version == _answers_version:
+        return 0
+    return load_pregenerated_answers()
+
+def start_answer_reload():
+    """Poll answer_cache so a running server picks up a new warm_cache.py run."""
+    global _answers_thread
+    if _answers_thread is not None:
+        return
+
+    def loop():
+        while True:
+            time.sleep(ANSWER_RELOAD_INTERVAL_S)
+            refresh_pregenerated_answers_if_changed()
+
+    _answers_thread = threading.Thread(target=loop, name="answer-cache-reload", daemon=True)
+    _answers_thread.start()
+
+# ======================
+#   Main Chat Wrapper
+# ======================
+@dataclass
+class PreparedAnswer:
+    """
+    Result of the cheap part of answering (no LLM call).
+    `answer` is set when the question was answered from cache or the DB;
+    otherwise `prompt` is ready to be sent to Gemini by `complete_answer`.
+    `cache_entry_id` identifies a semantic-cache hit, for false-hit feedback.
+    """
+    message: str
+    answer: Optional[str] = None
+    cache_entry_id: Optional[int] = None
+    prompt: Optional[str] = None
+    scope: Tuple = ()
+    fingerprint: Optional[str] = None
+    question_vector: Any = None
+
+def prepare_answer(message: str, history: List = []) -> PreparedAnswer:
+    # 0️⃣ Check if user wants to add a drug
+    if "اضيف" in message or "أدخل" in message or "اضافة" in message:
+        return PreparedAnswer(message, answer=add_drug_from_text(message))
+
+    # 1️⃣ DB search: the message is a drug name, or names exactly one drug
+    drug_info = search_drug(message)
+    if not drug_info:
+        mentioned = chunk_store.mentioned_drug(message)
+        drug_info = search_drug(mentioned) if mentioned else None
+    if drug_info:
+        scope = (drug_info["id"],)
+        relevant_context = build_drug_context(drug_info)
+    else:
+        # 2️⃣ Symptom mapping (precomputed snapshot, no DB round trips)
+        snapshot = symptom_kb.current
+        symptom = snapshot.match(message)
+        if symptom:
+            scope = snapshot.scopes[symptom]
+            relevant_context = snapshot.contexts[symptom]
+        else:
+            scope = ()
+            relevant_context = "❌ No direct match found for this drug or symptom in the database."
+
+    # 3️⃣ Exact cache lookup (same question + same context)
+    fingerprint = context_fingerprint(relevant_context)
+    cached = cache.get(message, fingerprint)
+    if cached:
+        logger.debug("cache hit", extra={"query": message})
+        return PreparedAnswer(message, answer=cached)
+
+    # 4️⃣ Semantic cache lookup (same drugs + same context + similar question).
+    # Skipped when nothing was retrieved: every such question shares one
+    # context, so a paraphrase match could be a question about another drug.
+    question_vector = None
+    if scope:
+        try:
+            question_vector = semantic_cache.embed(message)
+        except Exception as e:
+            logger.warning("semantic cache embedding failed: %s", e)
+        if question_vector is not None:
+            hit = semantic_cache.get(message, scope, fingerprint, vector=question_vector)
+            if hit:
+                return PreparedAnswer(message, answer=hit.answer, cache_entry_id=hit.id)
+
+    return PreparedAnswer(
+        message,
+        prompt=build_prompt(message, relevant_context, history),
+        scope=scope,
+        fingerprint=fingerprint,
+        question_vector=question_vector,
+    )
+
+def complete_answer(prepared: PreparedAnswer) -> str:
+    # 5️⃣ LLM call (the slow part)
+    if prepared.answer is not None:
+        return prepared.answer
+
+    answer, error = call_gemini(prepared.prompt)
+    if error:
+        return error
+
+    cache.set(prepared.message, answer, prepared.scope, prepared.fingerprint)
+    if prepared.question_vector is not None:
+        semantic_cache.set(prepared.message, answer, prepared.scope, prepared.fingerprint,
+                           vector=prepared.question_vector)
+    return answer
+
+def gemini_chat_wrapper(message: str, history: List = []):
+    return complete_answer(prepare_answer(message, history))
 
 if __name__ == "__main__":
     start = time.time()
     print(gemini_chat_wrapper("عايز اضيف دواء اسمه باراسيتامول\nلازمتة: مسكن ألم\nهو ايه: Analgesic"))
     end = time.time()
-    logging.info(f"Execution time: {end - start:.2f} seconds")
+    logger.info(f"Execution time: {end - start:.2f} seconds")
 
 
@@ -0,0 +1,446 @@
+# benchmarks.py
+# Run: python benchmarks.py [--profile] [name ...]   (no names = run all)
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+BENCHMARKS: Dict[str, Callable[[], Dict]] = {}
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark function under `name`.
+    Each benchmark returns a flat dict of results that gets printed.
+    """
+    def decorator(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return decorator
+
+
+# -------------------------------
+# Helpers
+# -------------------------------
+def percentile(samples: List[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: List[float], unit_scale: float = 1e6, unit: str = "us") -> Dict:
+    """
+    Summarize latency samples (seconds) as mean / p50 / p99 in `unit`.
+    """
+    return {
+        f"mean_{unit}": round(statistics.fmean(samples) * unit_scale, 2),
+        f"p50_{unit}": round(percentile(samples, 50) * unit_scale, 2),
+        f"p99_{unit}": round(percentile(samples, 99) * unit_scale, 2),
+        "n": len(samples),
+    }
+
+
+# -------------------------------
+# Logging overhead
+# -------------------------------
+@benchmark("logging")
+def bench_logging(n: int = 20000, burst: int = 1000) -> Dict:
+    """
+    Per-record cost on the caller thread of the queue-based logging pipeline,
+    i.e. what a request pays for each log line. Records are emitted in bursts
+    smaller than the queue and the queue is drained (untimed) between bursts,
+    so every sample measures the enqueue path rather than the drop path.
+    """
+    import logger as app_logging
+
+    def drain(handler):
+        while not handler.queue.empty():
+            time.sleep(0.001)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        handler = app_logging.setup_logging(level="DEBUG", log_file=os.path.join(tmp, "bench.log"),
+                                            sampling="bench.sampled=0.01", console=False)
+        burst = min(burst, handler.queue.maxsize // 2)
+        log = logging.getLogger("bench")
+        sampled = logging.getLogger("bench.sampled")
+        token = app_logging.set_request_id("bench-request")
+
+        info_samples = []
+        for i in range(n):
+            if i % burst == 0:
+                drain(handler)
+            start = time.perf_counter()
+            log.info("chat answered", extra={"query": "ينفع اخد ايبوبروفين؟", "latency_ms": i})
+            info_samples.append(time.perf_counter() - start)
+
+        debug_samples = []
+        for i in range(n):
+            if i % burst == 0:
+                drain(handler)
+            start = time.perf_counter()
+            sampled.debug("sampled debug %d", i)
+            debug_samples.append(time.perf_counter() - start)
+
+        app_logging.reset_request_id(token)
+        dropped = handler.dropped
+        app_logging.shutdown_logging()
+
+    results = {f"info_{k}": v for k, v in summarize(info_samples).items()}
+    results.update({f"sampled_debug_{k}": v for k, v in summarize(debug_samples).items()})
+    results["dropped"] = dropped  # should be 0; anything else means the numbers include drops
+    return results
+
+
+# -------------------------------
+# Embedding micro-batching
+# -------------------------------
+def synthetic_encoder(per_call_ms: float = 4.0, per_text_ms: float = 0.25, dim: int = 384):
+    """
+    Stand-in for model.encode with a fixed per-call cost plus a per-text cost,
+    which is the shape that makes batching pay off on CPU.
+    Set BENCH_EMBED_MODEL (e.g. BAAI/bge-small-en) to benchmark a real model.
+    """
+    model_name = os.getenv("BENCH_EMBED_MODEL")
+    if model_name:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name)
+        return lambda texts: model.encode(texts, convert_to_numpy=True)
+
+    def encode(texts):
+        time.sleep((per_call_ms + per_text_ms * len(texts)) / 1000)
+        return [[0.0] * dim for _ in texts]
+    return encode
+
+
+def run_concurrent(call: Callable[[int], None], callers: int, per_caller: int) -> Dict:
+    """
+    Run `call` from `callers` threads, `per_caller` times each.
+    Returns throughput and latency percentiles (ms).
+    """
+    import threading
+
+    samples: List[float] = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(callers + 1)
+
+    def worker(worker_id: int):
+        local = []
+        start_barrier.wait()
+        for i in range(per_caller):
+            t0 = time.perf_counter()
+            call(worker_id * per_caller + i)
+            local.append(time.perf_counter() - t0)
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(callers)]
+    for t in threads:
+        t.start()
+    start_barrier.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    results = summarize(samples, unit_scale=1e3, unit="ms")
+    results["throughput_per_s"] = round(len(samples) / elapsed, 1)
+    return results
+
+
+@benchmark("embedding")
+def bench_embedding(requests_total: int = 512) -> Dict:
+    """
+    Throughput and p99 of single-text embedding at 1, 16 and 128 concurrent
+    callers: inline encode (one call per text) vs the micro-batching executor.
+    """
+    import threading
+    from embedding_executor import EmbeddingExecutor
+
+    encode = synthetic_encoder()
+    results = {}
+    for callers in (1, 16, 128):
+        per_caller = max(1, requests_total // callers)
+
+        model_lock = threading.Lock()  # one model instance, as in embedding_service
+
+        def inline(i):
+            with model_lock:
+                encode([f"query {i}"])
+
+        for key, value in run_concurrent(inline, callers, per_caller).items():
+            results[f"inline_c{callers}_{key}"] = value
+
+        executor = EmbeddingExecutor(encode, max_queue_size=4096)
+        for key, value in run_concurrent(lambda i: executor.submit(f"query {i}").result(),
+                                         callers, per_caller).items():
+            results[f"batched_c{callers}_{key}"] = value
+        results[f"batched_c{callers}_avg_batch_size"] = executor.stats()["avg_batch_size"]
+        executor.shutdown()
+    return results
+
+
+# -------------------------------
+# Inference backends (PyTorch vs ONNX / int8)
+# -------------------------------
+def _probe_backend(kind: str, int8: bool, texts: List[str], rounds: int, out):
+    """
+    Runs in a fresh process so load time and peak RSS belong to one backend only.
+    """
+    import resource
+    from embedding_backends import load_backend
+
+    start = time.perf_counter()
+    backend = load_backend(kind, **({"int8": int8} if kind == "onnx" else {}))
+    load_s = time.perf_counter() - start
+
+    backend.encode(texts)  # warm-up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        backend.encode(texts)
+    elapsed = time.perf_counter() - start
+    out.put({
+        "load_s": round(load_s, 2),
+        "texts_per_s": round(len(texts) * rounds / elapsed, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    })
+
+
+@benchmark("inference_backends")
+def bench_inference_backends(rounds: int = 20) -> Dict:
+    """
+    Load time, encode throughput and peak memory of each embedding backend,
+    side by side on the catalog texts (batch of 32 by repetition).
+    """
+    import multiprocessing
+    from embedding_backends import catalog_texts
+
+    catalog = catalog_texts()
+    texts = (catalog * (32 // len(catalog) + 1))[:32]
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for label, kind, int8 in (("torch", "torch", False), ("onnx", "onnx", False), ("onnx_int8", "onnx", True)):
+        out = ctx.Queue()
+        proc = ctx.Process(target=_probe_backend, args=(kind, int8, texts, rounds, out))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            results[f"{label}_error"] = f"exit code {proc.exitcode}"
+            continue
+        for key, value in out.get().items():
+            results[f"{label}_{key}"] = value
+    return results
+
+
+# -------------------------------
+# Admission control under LLM saturation
+# -------------------------------
+async def _chat_load(use_lanes: bool, llm_callers: int = 200, llm_s: float = 0.3, prepare_s: float = 0.0005,
+                     hit_requests: int = 300, hit_interval_s: float = 0.005) -> Dict:
+    """
+    `llm_callers` clients hammer the LLM path (Gemini simulated by a `llm_s`
+    sleep) while one client sends cache hits. Without lanes everything shares
+    one 40-thread pool, like FastAPI's default threadpool for sync endpoints.
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from admission import AdmissionController, Overloaded
+
+    loop = asyncio.get_running_loop()
+    controller = AdmissionController(user_rate_per_min=1e9, user_burst=1e9)
+    shared = ThreadPoolExecutor(max_workers=40)
+    stop = asyncio.Event()
+    counts = {"llm_done": 0, "llm_shed": 0}
+
+    async def llm_client():
+        while not stop.is_set():
+            try:
+                if use_lanes:
+                    await controller.fast.run(time.sleep, prepare_s)
+                    await controller.llm.run(time.sleep, llm_s)
+                else:
+                    await loop.run_in_executor(shared, time.sleep, prepare_s + llm_s)
+                counts["llm_done"] += 1
+            except Overloaded:
+                counts["llm_shed"] += 1
+                await asyncio.sleep(0.05)
+
+    clients = [asyncio.create_task(llm_client()) for _ in range(llm_callers)]
+    await asyncio.sleep(llm_s)  # let the LLM path saturate first
+
+    samples = []
+
+    async def cache_hit():
+        t0 = time.perf_counter()
+        if use_lanes:
+            await controller.fast.run(time.sleep, prepare_s)
+        else:
+            await loop.run_in_executor(shared, time.sleep, prepare_s)
+        samples.append(time.perf_counter() - t0)
+
+    hits = []
+    for _ in range(hit_requests):
+        hits.append(asyncio.create_task(cache_hit()))
+        await asyncio.sleep(hit_interval_s)
+    await asyncio.gather(*hits)
+
+    stop.set()
+    await asyncio.gather(*clients)
+    shared.shutdown()
+    results = {f"cache_hit_{k}": v for k, v in summarize(samples, unit_scale=1e3, unit="ms").items()}
+    results.update(counts)
+    if use_lanes:
+        results["llm_lane_shed"] = controller.llm.metrics()["shed"]
+    return results
+
+
+@benchmark("admission")
+def bench_admission() -> Dict:
+    """
+    Cache-hit latency while the LLM path is saturated: shared threadpool vs
+    admission-controlled fast / LLM lanes.
+    """
+    import asyncio
+
+    results = {}
+    for label, use_lanes in (("shared_pool", False), ("lanes", True)):
+        for key, value in asyncio.run(_chat_load(use_lanes)).items():
+            results[f"{label}_{key}"] = value
+    return results
+
+
+# -------------------------------
+# Field-level retrieval
+# -------------------------------
+SAMPLE_DRUG = {
+    "id": 1, "drug_name": "Ibuprofen", "generic_name": "Ibuprofen", "drug_class": "NSAID",
+    "indication": "Pain, fever", "status_after_sleeve": "Avoid",
+    "reason": "Raises the risk of marginal ulcers after sleeve gastrectomy",
+    "dose_adjustment_notes": "Avoid; use paracetamol instead",
+    "administration_form": "Tablet", "interactions": "Anticoagulants",
+    "notes": "Short courses only with a PPI and medical approval",
+}
+
+# (question, expected chunk fields)
+RETRIEVAL_CASES = [
+    ("Ibuprofen", ["drug"]),
+    ("Ibuprofen dose", ["dose_adjustment_notes"]),
+    ("what is the dose of Ibuprofen", ["dose_adjustment_notes"]),
+    ("ايه جرعة Ibuprofen", ["dose_adjustment_notes"]),
+    ("ليه Ibuprofen ممنوع؟", ["reason"]),
+    ("ينفع اخد ايبوبروفين؟", []),   # Arabic spelling is not a catalog name
+]
+
+
+@benchmark("retrieval")
+def bench_retrieval(rounds: int = 2000) -> Dict:
+    """
+    Checks that a question naming a drug gets only the field chunks it asks
+    about (a dose question -> dose_adjustment_notes), then times
+    answer_question's retrieval. Uses an in-memory mirror, no DB reads.
+    """
+    import rag_pipeline
+    from chunk_store import build_chunks, store
+
+    store.load_rows([(c.drug_id, c.drug_name, SAMPLE_DRUG["generic_name"], c.field, c.text, c.token_count,
+                      c.content_hash, None) for c in build_chunks(SAMPLE_DRUG)])
+    for question, expected in RETRIEVAL_CASES:
+        if expected:
+            got = [c.id.split(":", 1)[1] for c in rag_pipeline.retrieve_context(
+                question, fields=rag_pipeline.select_fields(question))]
+        else:
+            got = [] if store.resolve_drug(question) is None else ["resolved"]
+        if got != expected:
+            raise AssertionError(f"{question!r}: expected {expected}, got {got}")
+
+    resolvable = [question for question, expected in RETRIEVAL_CASES if expected]  # the rest would hit the DB
+    samples = []
+    for i in range(rounds):
+        question = resolvable[i % len(resolvable)]
+        start = time.perf_counter()
+        rag_pipeline.answer_question(question)
+        samples.append(time.perf_counter() - start)
+    results = {"field_selection": f"ok ({len(RETRIEVAL_CASES)} cases)"}
+    results.update({f"answer_question_{k}": v for k, v in summarize(samples).items()})
+    return results
+
+
+# -------------------------------
+# Profiling hooks overhead
+# -------------------------------
+def _cpu_work(n: int = 2000) -> int:
+    return sum(i * i for i in range(n))
+
+
+@benchmark("profiling")
+def bench_profiling(n: int = 2000) -> Dict:
+    """
+    Cost of the per-request profiling check when profiling is off, and the
+    slowdown of a CPU-bound call while the sampler is running.
+    """
+    from profiling import SamplingProfiler, request_profiler
+
+    off_samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        request_profiler(None)
+        off_samples.append(time.perf_counter() - start)
+
+    def timed_work(fn) -> List[float]:
+        samples = []
+        for _ in range(n):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    baseline = timed_work(_cpu_work)
+    with SamplingProfiler() as profiler:
+        sampled = timed_work(_cpu_work)
+
+    results = {f"check_off_{k}": v for k, v in summarize(off_samples).items()}
+    results.update({f"work_baseline_{k}": v for k, v in summarize(baseline).items()})
+    results.update({f"work_sampled_{k}": v for k, v in summarize(sampled).items()})
+    results["sampler_samples"] = profiler.samples
+    results["top_function"] = profiler.top(1)[0]["function"] if profiler.samples else None
+    return results
+
+
+# -------------------------------
+# MAIN
+# -------------------------------
+def run(names: List[str], profile: bool = False):
+    """
+    Run the named benchmarks (all if none). With `profile=True` each one runs
+    under the sampling profiler and leaves a collapsed-stack artifact.
+    """
+    for name in names or list(BENCHMARKS):
+        if name not in BENCHMARKS:
+            print(f"⚠️ Unknown benchmark '{name}'. Available: {', '.join(BENCHMARKS)}")
+            continue
+        print(f"== {name} ==")
+        profiler = None
+        if profile:
+            from profiling import SamplingProfiler
+            profiler = SamplingProfiler().start()
+        try:
+            results = BENCHMARKS[name]()
+        except ImportError as e:
+            print(f"   skipped (missing dependency: {e})")
+            continue
+        finally:
+            if profiler:
+                profiler.stop()
+        for key, value in results.items():
+            print(f"   {key}: {value}")
+        if profiler:
+            print(f"   profile: {profiler.write(f'bench-{name}')}")
+
+
+if __name__ == "__main__":
+    # python benchmarks.py [--profile] [name ...]
+    args = sys.argv[1:]
+    run([a for a in args if a != "--profile"], profile="--profile" in args)
@@ -0,0 +1,130 @@
+# catalog.py
+# Catalog browsing for /drugs: keyset cursors, field projection and ETags.
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from db import DRUG_FILTER_COLUMNS, DRUG_LIST_COLUMNS, get_catalog_version, list_drugs_page
+
+# ---------- General settings ----------
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+VERSION_TTL_S = float(os.getenv("CATALOG_VERSION_TTL_S", "2"))   # how stale the cached version may be
+PAGE_CACHE_SIZE = 256
+DEFAULT_FIELDS = ["drug_name", "generic_name", "drug_class", "status_after_sleeve", "administration_form"]
+
+
+class InvalidQuery(ValueError):
+    """
+    Bad filter, field or cursor in a /drugs request (maps to HTTP 400).
+    """
+
+
+class CatalogVersion:
+    """
+    In-memory copy of the catalog_version counter, re-read at most every
+    `ttl` seconds. `bump()` makes this process see its own writes at once.
+    """
+    def __init__(self, ttl: float = VERSION_TTL_S):
+        self.ttl = ttl
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> int:
+        now = time.monotonic()
+        version = self._version  # single read: bump() may reset it at any time
+        if version is None or now - self._checked_at > self.ttl:
+            with self._lock:
+                version = self._version
+                if version is None or now - self._checked_at > self.ttl:
+                    version = get_catalog_version()
+                    self._version = version
+                    self._checked_at = now
+        return version
+
+    def bump(self):
+        with self._lock:
+            self._version = None
+
+
+catalog_version = CatalogVersion()
+_page_cache: "OrderedDict[str, dict]" = OrderedDict()
+_page_cache_lock = threading.Lock()
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"after": last_id}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded))["after"])
+    except Exception:
+        raise InvalidQuery("invalid cursor")
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return DEFAULT_FIELDS
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in DRUG_LIST_COLUMNS]
+    if unknown:
+        raise InvalidQuery(f"unknown fields: {', '.join(unknown)}")
+    return requested
+
+
+def page_etag(version: int, filters: Dict[str, str], fields: List[str], after_id: int, limit: int) -> str:
+    """
+    Weak ETag of a page: catalog version + the exact query that produced it.
+    """
+    query = json.dumps([sorted(filters.items()), fields, after_id, limit])
+    return f'W/"v{version}-{hashlib.sha1(query.encode()).hexdigest()[:16]}"'
+
+
+def get_drugs_page(filters: Dict[str, Optional[str]], fields: Optional[str] = None, cursor: Optional[str] = None,
+                   limit: int = DEFAULT_LIMIT, if_none_match: Optional[str] = None):
+    """
+    Returns (etag, body). body is None when `if_none_match` already matches
+    the current page, in which case no query touches the meds table.
+    """
+    filters = {k: v for k, v in filters.items() if v is not None}
+    unknown = [k for k in filters if k not in DRUG_FILTER_COLUMNS]
+    if unknown:
+        raise InvalidQuery(f"cannot filter on: {', '.join(unknown)}")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise InvalidQuery(f"limit must be between 1 and {MAX_LIMIT}")
+    projected = parse_fields(fields)
+    after_id = decode_cursor(cursor)
+
+    etag = page_etag(catalog_version.get(), filters, projected, after_id, limit)
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return etag, None
+
+    with _page_cache_lock:
+        body = _page_cache.get(etag)
+        if body is not None:
+            _page_cache.move_to_end(etag)
+            return etag, body
+
+    rows, has_more = list_drugs_page(filters, projected, after_id=after_id, limit=limit)
+    for row in rows:
+        if row.get("last_reviewed") is not None:
+            row["last_reviewed"] = str(row["last_reviewed"])
+    body = {
+        "items": rows,  # projected fields + id
+        "next_cursor": encode_cursor(rows[-1]["id"]) if has_more else None,
+    }
+    with _page_cache_lock:
+        _page_cache[etag] = body
+        while len(_page_cache) > PAGE_CACHE_SIZE:
+            _page_cache.popitem(last=False)
+    return etag, body
@@ -0,0 +1,469 @@
+# chunk_store.py
+# Precomputed per-drug and per-field retrieval chunks, with an in-memory mirror.
+# Run: python chunk_store.py   -> create the table and (re)build changed chunks
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from db import create_catalog_indexes, get_bulk_embeddings, get_connection, list_drugs
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# ---------- General settings ----------
+DRUG_CHUNK = "drug"   # the whole-drug summary chunk
+RELOAD_AFTER_FAILURE_S = 60
+RELOAD_INTERVAL_S = float(os.getenv("CHUNK_STORE_RELOAD_S", "30"))
+SYNC_LOCK_KEY = 0x6d65645f63686b   # pg advisory lock: one process syncs at a time
+FIELD_LABELS = {
+    "reason": "Reason",
+    "dose_adjustment_notes": "Dose Adjustment",
+    "interactions": "Interactions",
+    "notes": "Notes",
+}
+# Question words that point at a single field (Arabic + English)
+FIELD_KEYWORDS = {
+    "reason": ["ليه", "سبب", "why", "reason"],
+    "dose_adjustment_notes": ["جرعة", "جرعه", "الجرعة", "كام مرة", "dose", "dosage"],
+    "interactions": ["تداخل", "مع دوا", "مع دواء", "interaction"],
+    "notes": ["ملاحظات", "ملاحظة", "تحذير", "notes", "warning"],
+}
+
+
+@dataclass
+class Chunk:
+    drug_id: int
+    drug_name: str
+    field: str
+    text: str
+    token_count: int
+    content_hash: str
+    embedding: Optional[np.ndarray] = field(default=None, repr=False)
+
+    @property
+    def id(self) -> str:
+        return f"{self.drug_name}:{self.field}"
+
+
+# -------------------------------
+# Chunk building
+# -------------------------------
+def count_tokens(text: str) -> int:
+    """
+    Cheap token estimate (whitespace words * 1.3), good enough for prompt budgeting.
+    """
+    return int(len(text.split()) * 1.3) + 1
+
+
+def build_chunks(drug: dict) -> List[Chunk]:
+    """
+    Turn one meds row into its summary chunk plus one chunk per non-empty text field.
+    """
+    summary = (
+        f"Drug Name: {drug['drug_name']}\n"
+        f"Generic: {drug['generic_name']}\n"
+        f"Class: {drug['drug_class']}\n"
+        f"Indication: {drug['indication']}\n"
+        f"Status After Sleeve: {drug['status_after_sleeve']}\n"
+        f"Reason: {drug['reason']}\n"
+        f"Dose Adjustment: {drug['dose_adjustment_notes']}\n"
+        f"Form: {drug['administration_form']}\n"
+        f"Notes: {drug['notes']}\n"
+    )
+    texts = {DRUG_CHUNK: summary}
+    for name, label in FIELD_LABELS.items():
+        value = (drug.get(name) or "").strip()
+        if value:
+            texts[name] = (
+                f"Drug Name: {drug['drug_name']} ({drug['generic_name']})\n"
+                f"Status After Sleeve: {drug['status_after_sleeve']}\n"
+                f"{label}: {value}\n"
+            )
+    return [
+        Chunk(drug["id"], drug["drug_name"], name, text, count_tokens(text),
+              hashlib.sha1(text.encode()).hexdigest())
+        for name, text in texts.items()
+    ]
+
+
+def pick_chunks(chunks: Dict[str, Chunk], fields: Optional[List[str]] = None) -> List[Chunk]:
+    """
+    The requested field chunks of one drug, or its summary chunk when no
+    field is requested (or none of the requested fields has content).
+    """
+    if fields:
+        selected = [chunks[f] for f in fields if f in chunks]
+        if selected:
+            return selected
+    return [chunks[DRUG_CHUNK]] if DRUG_CHUNK in chunks else []
+
+
+def select_fields(question: str) -> Optional[List[str]]:
+    """
+    Fields a question is about, or None when it is a general question
+    (then the summary chunk is the right answer).
+    """
+    question = question.lower()
+    fields = [name for name, keywords in FIELD_KEYWORDS.items() if any(k in question for k in keywords)]
+    return fields or None
+
+
+# -------------------------------
+# DB table
+# -------------------------------
+_table_ready = False
+_sync_lock = threading.Lock()
+
+
+def create_chunk_table():
+    """
+    Create med_chunks (idempotent). Also ensures meds' catalog_version
+    exists, since the mirror re-syncs when it changes.
+    """
+    create_catalog_indexes()
+    ensure_chunk_table()
+
+
+def ensure_chunk_table():
+    """
+    Once per process (safe on the write-queue path): create med_chunks and
+    chunk_sync_state, and give meds a trigger-maintained updated_at so a
+    sync only reads rows changed since the last one. DDL touching meds only
+    runs when the column / trigger is actually missing.
+    """
+    global _table_ready
+    if _table_ready:
+        return
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT
+                EXISTS (SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'meds' AND column_name = 'updated_at'),
+                EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'meds_touch_updated_at');
+        """)
+        has_column, has_trigger = cur.fetchone()
+        if not has_column:
+            cur.execute("ALTER TABLE meds ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW();")
+        if not has_trigger:
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION touch_meds_updated_at() RETURNS trigger AS $$
+                BEGIN
+                    NEW.updated_at = NOW();
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql;
+            """)
+            cur.execute("""
+                CREATE TRIGGER meds_touch_updated_at
+                BEFORE UPDATE ON meds
+                FOR EACH ROW EXECUTE FUNCTION touch_meds_updated_at();
+            """)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_sync_state (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            synced_at TIMESTAMP
+        );
+        INSERT INTO chunk_sync_state (id, synced_at) VALUES (TRUE, NULL) ON CONFLICT DO NOTHING;
+        """)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS med_chunks (
+            id SERIAL PRIMARY KEY,
+            drug_id INTEGER REFERENCES meds(id) ON DELETE CASCADE,
+            field TEXT,
+            text TEXT,
+            token_count INTEGER,
+            content_hash TEXT,
+            embedding JSONB,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            UNIQUE (drug_id, field)
+        );
+        """)
+    conn.commit()
+    conn.close()
+    _table_ready = True
+
+
+def get_versions() -> Tuple[int, tuple]:
+    """
+    (catalog_version, (chunk count, last chunk update)): the first changes on
+    any meds edit, the second when any process rewrites med_chunks.
+    """
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT (SELECT version FROM catalog_version), COUNT(*), MAX(updated_at)
+            FROM med_chunks;
+        """)
+        catalog, count, updated_at = cur.fetchone()
+    conn.close()
+    return catalog, (count, str(updated_at))
+
+
+def sync_chunks(drug_ids: Optional[Iterable[int]] = None, changed_since=None) -> dict:
+    """
+    Rebuild chunks for the given drugs (all drugs if None), optionally only
+    those whose meds row changed since `changed_since`. Only chunks whose
+    content hash changed are re-embedded (on the bulk embedding worker, off
+    the request path) and written; chunks for fields that became empty are
+    deleted. Refreshes the in-memory mirror afterwards.
+    """
+    ensure_chunk_table()
+    with _sync_lock:
+        result = _sync(drug_ids, changed_since)
+    store.load()
+    logger.info("chunk store synced", extra=result)
+    return result
+
+
+def sync_changed_chunks() -> Optional[dict]:
+    """
+    Catalog-wide incremental sync, run by one process at a time: rows
+    changed since the last successful sync (any process's) are re-chunked.
+    Returns None when another process holds the sync lock.
+    """
+    ensure_chunk_table()
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s);", (SYNC_LOCK_KEY,))
+            if not cur.fetchone()[0]:
+                return None
+            # Overlap: rows from transactions still open at NOW() can commit with an older updated_at
+            cur.execute("SELECT synced_at, NOW() - INTERVAL '60 seconds' FROM chunk_sync_state;")
+            since, started = cur.fetchone()
+        conn.commit()  # don't sit idle in a transaction while embedding
+        result = sync_chunks(changed_since=since)
+        with conn.cursor() as cur:
+            cur.execute("UPDATE chunk_sync_state SET synced_at = %s;", (started,))
+            cur.execute("SELECT pg_advisory_unlock(%s);", (SYNC_LOCK_KEY,))
+        conn.commit()
+        return result
+    finally:
+        conn.close()  # also releases the advisory lock if the sync failed
+
+
+def _sync(drug_ids: Optional[Iterable[int]], changed_since=None) -> dict:
+    wanted = set(drug_ids) if drug_ids is not None else None
+    drugs = [d for d in list_drugs(changed_since) if wanted is None or d["id"] in wanted]
+    if not drugs:
+        return {"drugs": 0, "changed": 0, "removed": 0}
+
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("SELECT drug_id, field, content_hash FROM med_chunks WHERE drug_id = ANY(%s);",
+                    ([d["id"] for d in drugs],))
+        stored: Dict[int, Dict[str, str]] = {}
+        for drug_id, name, content_hash in cur.fetchall():
+            stored.setdefault(drug_id, {})[name] = content_hash
+
+    changed: List[Chunk] = []
+    removed = []
+    for drug in drugs:
+        chunks = build_chunks(drug)
+        hashes = stored.get(drug["id"], {})
+        changed.extend(c for c in chunks if hashes.get(c.field) != c.content_hash)
+        current = {c.field for c in chunks}
+        removed.extend((drug["id"], name) for name in hashes if name not in current)
+
+    if changed:
+        embeddings = get_bulk_embeddings([c.text for c in changed])
+        with conn.cursor() as cur:
+            cur.executemany("""
+                INSERT INTO med_chunks (drug_id, field, text, token_count, content_hash, embedding, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, NOW())
+                ON CONFLICT (drug_id, field) DO UPDATE
+                SET text = EXCLUDED.text, token_count = EXCLUDED.token_count,
+                    content_hash = EXCLUDED.content_hash, embedding = EXCLUDED.embedding,
+                    updated_at = EXCLUDED.updated_at;
+            """, [(c.drug_id, c.field, c.text, c.token_count, c.content_hash, json.dumps(emb))
+                  for c, emb in zip(changed, embeddings)])
+    if removed:
+        with conn.cursor() as cur:
+            cur.executemany("DELETE FROM med_chunks WHERE drug_id = %s AND field = %s;", removed)
+    conn.commit()
+    conn.close()
+    return {"drugs": len(drugs), "changed": len(changed), "removed": len(removed)}
+
+
+def build_mention_pattern(names: Iterable[str]) -> Optional["re.Pattern"]:
+    """
+    One regex matching any known name as a whole word, longest names first
+    so "Vitamin B Complex" wins over a shorter name inside it.
+    """
+    ordered = sorted(names, key=len, reverse=True)
+    if not ordered:
+        return None
+    return re.compile(r"(?<!\w)(" + "|".join(re.escape(n) for n in ordered) + r")(?!\w)")
+
+
+# -------------------------------
+# In-memory mirror
+# -------------------------------
+class ChunkStore:
+    """
+    Read-only mirror of med_chunks used on the request path.
+    `load()` builds a new snapshot and swaps it in, so readers never lock.
+
+    A background loop (`start_auto_reload`) polls `get_versions()`: a new
+    catalog_version (any meds edit) re-syncs the changed rows' chunks, and a
+    med_chunks change made by another process (e.g. `python chunk_store.py`)
+    reloads the mirror.
+    """
+    def __init__(self, reload_interval: float = RELOAD_INTERVAL_S):
+        self.reload_interval = reload_interval
+        self._snapshot: Optional[dict] = None
+        self._load_lock = threading.Lock()
+        self._synced_catalog: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def load(self):
+        versions = get_versions()
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.drug_id, m.drug_name, m.generic_name, c.field, c.text,
+                       c.token_count, c.content_hash, c.embedding
+                FROM med_chunks c JOIN meds m ON m.id = c.drug_id
+                ORDER BY c.drug_id, c.field;
+            """)
+            rows = cur.fetchall()
+        conn.close()
+        self.load_rows(rows, chunk_versions=versions[1])
+
+    def load_rows(self, rows: Iterable[tuple], chunk_versions: Optional[tuple] = None):
+        """
+        Build and swap in a snapshot from (drug_id, drug_name, generic_name,
+        field, text, token_count, content_hash, embedding) rows.
+        """
+        by_drug: Dict[int, Dict[str, Chunk]] = {}
+        names: Dict[str, int] = {}
+        chunks: List[Chunk] = []
+        for drug_id, drug_name, generic_name, name, text, tokens, content_hash, emb in rows:
+            vector = np.asarray(emb if not isinstance(emb, str) else json.loads(emb), dtype=np.float32) \
+                if emb is not None else None
+            chunk = Chunk(drug_id, drug_name, name, text, tokens, content_hash, vector)
+            by_drug.setdefault(drug_id, {})[name] = chunk
+            chunks.append(chunk)
+            for n in (drug_name, generic_name):
+                if n:
+                    names[n.lower()] = drug_id
+
+        embedded = [c for c in chunks if c.embedding is not None]
+        matrix = np.stack([c.embedding for c in embedded]) if embedded else None
+        if matrix is not None:
+            matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        self._snapshot = {"by_drug": by_drug, "names": names, "mentions": build_mention_pattern(names),
+                          "embedded": embedded, "matrix": matrix, "failed_at": None, "chunks": chunk_versions}
+
+    def _get(self) -> dict:
+        if self._snapshot is None or (self._snapshot["failed_at"]
+                                      and time.time() - self._snapshot["failed_at"] > RELOAD_AFTER_FAILURE_S):
+            with self._load_lock:
+                if self._snapshot is None or self._snapshot["failed_at"]:
+                    try:
+                        self.load()
+                    except Exception as e:
+                        # Table missing / DB down: serve empty (callers fall back to meds) and retry later
+                        logger.warning("chunk store load failed: %s", e)
+                        self._snapshot = {"by_drug": {}, "names": {}, "mentions": None, "embedded": [],
+                                          "matrix": None, "failed_at": time.time(), "chunks": None}
+        return self._snapshot
+
+    def refresh_if_changed(self) -> bool:
+        """
+        Cheap version check; re-syncs after meds edits, reloads after
+        med_chunks changes. Returns True if the mirror was rebuilt.
+
+        Only one process syncs a given change (advisory lock) and it reads
+        only rows changed since the last sync; the others pick the new
+        chunks up through the med_chunks check below.
+        """
+        try:
+            ensure_chunk_table()
+            catalog, chunks = get_versions()
+            if catalog != self._synced_catalog:
+                if sync_changed_chunks() is not None:
+                    self._synced_catalog = catalog
+                    return True
+                # Another process is syncing: retry next tick (cheap once it's done)
+            snapshot = self._snapshot
+            if snapshot is None or snapshot["failed_at"] or snapshot["chunks"] != chunks:
+                with self._load_lock:
+                    self.load()
+                return True
+        except Exception as e:
+            logger.warning("chunk store refresh failed: %s", e)
+        return False
+
+    def start_auto_reload(self):
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                self.refresh_if_changed()
+                time.sleep(self.reload_interval)
+
+        self._thread = threading.Thread(target=loop, name="chunk-store-reload", daemon=True)
+        self._thread.start()
+
+    def find_drug(self, name: str) -> Optional[int]:
+        return self._get()["names"].get(name.strip().lower())
+
+    def mentioned_drug_id(self, text: str) -> Optional[int]:
+        """
+        Id of the one drug a free-text question mentions (by drug or generic
+        name, as a whole word), or None when it names no drug or several.
+        """
+        snapshot = self._get()
+        if snapshot["mentions"] is None:
+            return None
+        ids = {snapshot["names"][m.lower()] for m in snapshot["mentions"].findall(text.lower())}
+        return ids.pop() if len(ids) == 1 else None
+
+    def mentioned_drug(self, text: str) -> Optional[str]:
+        drug_id = self.mentioned_drug_id(text)
+        if drug_id is None:
+            return None
+        return next(iter(self._get()["by_drug"][drug_id].values())).drug_name
+
+    def resolve_drug(self, text: str) -> Optional[int]:
+        """
+        The drug a query is about: an exact drug / generic name, else the one drug it mentions.
+        """
+        drug_id = self.find_drug(text)
+        return drug_id if drug_id is not None else self.mentioned_drug_id(text)
+
+    def drug_chunks(self, drug_id: int, fields: Optional[List[str]] = None) -> List[Chunk]:
+        return pick_chunks(self._get()["by_drug"].get(drug_id, {}), fields)
+
+    def search(self, query_vector, top_k: int = 5) -> List[tuple]:
+        """
+        Cosine search over every chunk embedding. Returns [(chunk, score), ...].
+        """
+        snapshot = self._get()
+        if snapshot["matrix"] is None:
+            return []
+        q = np.asarray(query_vector, dtype=np.float32)
+        scores = snapshot["matrix"] @ (q / np.linalg.norm(q))
+        best = np.argsort(-scores)[:top_k]
+        return [(snapshot["embedded"][i], float(scores[i])) for i in best]
+
+
+store = ChunkStore()
+
+
+# -------------------------------
+# MAIN
+# -------------------------------
+if __name__ == "__main__":
+    create_chunk_table()
+    print(sync_chunks())
@@ -2,7 +2,8 @@ import sqlite3
 from datetime import date
 import csv
 import psycopg
-from sentence_transformers import SentenceTransformer
+from embedding_backends import load_backend
+from embedding_executor import EmbeddingExecutor
 import json
 
 # -------------------------------
@@ -170,10 +171,22 @@ def test_postgres_connection():
 # Part (3): Embeddings Update
 # -------------------------------
 
-model = SentenceTransformer("BAAI/bge-base-en")
+model = load_backend(model_name="BAAI/bge-base-en")
+
+# Query-time encodes share one worker thread and get micro-batched together
+executor = EmbeddingExecutor(lambda texts: model.encode(texts).tolist(),
+                             name="db-embedding-worker")
+
+# Background bulk encodes (chunk syncs, new-drug indexing) get their own worker,
+# so a large sync never queues ahead of live requests
+bulk_executor = EmbeddingExecutor(lambda texts: model.encode(texts).tolist(), max_batch_size=64,
+                                  name="db-bulk-embedding-worker")
 
 def get_embeddings(texts):
-    return model.encode(texts, convert_to_numpy=True).tolist()
+    return executor.encode(list(texts), timeout=None)
+
+def get_bulk_embeddings(texts):
+    return bulk_executor.encode(list(texts), timeout=None)
 
 def update_embeddings():
     conn = get_connection()
@@ -217,12 +230,52 @@ def insert_drug(entry: dict):
     conn.commit()
     conn.close()
 
+def insert_drugs(entries):
+    """
+    Insert a batch of drugs in one transaction, without embeddings.
+    Each entry runs under its own savepoint, so a bad row doesn't abort the others.
+    Returns (drug_id, error) per entry: (id, None) inserted, (None, None) already
+    existed, (None, message) failed.
+    """
+    results = []
+    conn = get_connection()
+    with conn.cursor() as cur:
+        for entry in entries:
+            cols = ",".join(entry.keys())
+            placeholders = ",".join(["%s"] * len(entry))
+            cur.execute("SAVEPOINT drug_insert;")
+            try:
+                cur.execute(f"""
+                    INSERT INTO meds ({cols}) VALUES ({placeholders})
+                    ON CONFLICT (drug_name) DO NOTHING
+                    RETURNING id;
+                """, tuple(entry.values()))
+                result = cur.fetchone()
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT drug_insert;")
+                results.append((None, str(e)))
+                continue
+            cur.execute("RELEASE SAVEPOINT drug_insert;")
+            results.append((result[0] if result else None, None))
+    conn.commit()
+    conn.close()
+    return results
+
+def set_embeddings(pairs):
+    """Store [(drug_id, embedding), ...] in one transaction."""
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.executemany("UPDATE meds SET embedding = %s WHERE id = %s;",
+                        [(json.dumps(emb), drug_id) for drug_id, emb in pairs])
+    conn.commit()
+    conn.close()
+
 def search_drug(query: str):
     """Search drug by name in PostgreSQL and return details."""
     conn = get_connection()
     with conn.cursor() as cur:
         cur.execute("""
-            SELECT drug_name, generic_name, drug_class, indication,
+            SELECT id, drug_name, generic_name, drug_class, indication,
                    status_after_sleeve, reason, dose_adjustment_notes,
                    administration_form, interactions, evidence_level,
                    source_links, notes
@@ -236,21 +289,194 @@ def search_drug(query: str):
 
     if row:
         return {
-            "drug_name": row[0],
-            "generic_name": row[1],
-            "drug_class": row[2],
-            "indication": row[3],
-            "status_after_sleeve": row[4],
-            "reason": row[5],
-            "dose_adjustment_notes": row[6],
-            "administration_form": row[7],
-            "interactions": row[8],
-            "evidence_level": row[9],
-            "source_links": row[10],
-            "notes": row[11],
+            "id": row[0],
+            "drug_name": row[1],
+            "generic_name": row[2],
+            "drug_class": row[3],
+            "indication": row[4],
+            "status_after_sleeve": row[5],
+            "reason": row[6],
+            "dose_adjustment_notes": row[7],
+            "administration_form": row[8],
+            "interactions": row[9],
+            "evidence_level": row[10],
+            "source_links": row[11],
+            "notes": row[12],
         }
     return None
 
+def list_drugs(changed_since=None):
+    """
+    Return every drug row (same keys as search_drug, plus last_reviewed),
+    or only rows with updated_at >= changed_since (see chunk_store.create_chunk_table).
+    """
+    where, params = ("WHERE updated_at >= %s", (changed_since,)) if changed_since is not None else ("", ())
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT id, drug_name, generic_name, drug_class, indication,
+                   status_after_sleeve, reason, dose_adjustment_notes,
+                   administration_form, interactions, evidence_level,
+                   source_links, notes, last_reviewed
+            FROM meds
+            {where}
+            ORDER BY id;
+        """, params)
+        cols = [d[0] for d in cur.description]
+        rows = cur.fetchall()
+    conn.close()
+    return [dict(zip(cols, row)) for row in rows]
+
+# -------------------------------
+# Part (5): Pre-generated answer cache
+# -------------------------------
+
+def create_answer_cache_table():
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            drug_id INTEGER REFERENCES meds(id) ON DELETE CASCADE,
+            intent TEXT,
+            question TEXT,
+            answer TEXT,
+            fingerprint TEXT,
+            version TEXT,
+            generated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (drug_id, intent)
+        );
+        """)
+    conn.commit()
+    conn.close()
+
+def get_answer_versions():
+    """Return {(drug_id, intent): version} for every stored answer."""
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("SELECT drug_id, intent, version FROM answer_cache;")
+        rows = cur.fetchall()
+    conn.close()
+    return {(drug_id, intent): version for drug_id, intent, version in rows}
+
+def get_answer_cache_version():
+    """Cheap change signal for answer_cache: (row count, latest generated_at)."""
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*), MAX(generated_at) FROM answer_cache;")
+        count, latest = cur.fetchone()
+    conn.close()
+    return (count, str(latest))
+
+def save_cached_answer(drug_id, intent, question, answer, fingerprint, version):
+    """Upsert one pre-generated answer (committed immediately, so it doubles as a checkpoint)."""
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO answer_cache (drug_id, intent, question, answer, fingerprint, version, generated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, NOW())
+            ON CONFLICT (drug_id, intent) DO UPDATE
+            SET question = EXCLUDED.question, answer = EXCLUDED.answer,
+                fingerprint = EXCLUDED.fingerprint, version = EXCLUDED.version,
+                generated_at = EXCLUDED.generated_at;
+        """, (drug_id, intent, question, answer, fingerprint, version))
+    conn.commit()
+    conn.close()
+
+def load_cached_answers():
+    """Return all pre-generated answers as dicts."""
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("SELECT drug_id, intent, question, answer, fingerprint, version FROM answer_cache;")
+        cols = [d[0] for d in cur.description]
+        rows = cur.fetchall()
+    conn.close()
+    return [dict(zip(cols, row)) for row in rows]
+
+# -------------------------------
+# Part (6): Catalog listing (/drugs)
+# -------------------------------
+
+# Columns the listing API may return / filter on (never the embedding)
+DRUG_LIST_COLUMNS = [
+    "id", "drug_name", "generic_name", "drug_class", "indication",
+    "status_after_sleeve", "reason", "dose_adjustment_notes", "administration_form",
+    "interactions", "evidence_level", "source_links", "last_reviewed", "notes",
+]
+DRUG_FILTER_COLUMNS = ["status_after_sleeve", "drug_class", "administration_form"]
+
+def create_catalog_indexes():
+    """
+    Composite (filter, id) indexes for keyset pagination, plus a catalog
+    version counter bumped by a trigger on every change to listed columns.
+    """
+    conn = get_connection()
+    with conn.cursor() as cur:
+        for col in DRUG_FILTER_COLUMNS:
+            cur.execute(f"CREATE INDEX IF NOT EXISTS meds_{col}_id_idx ON meds ({col}, id);")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS meds_status_class_id_idx
+            ON meds (status_after_sleeve, drug_class, id);
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_version (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                version BIGINT NOT NULL
+            );
+            INSERT INTO catalog_version (id, version) VALUES (TRUE, 1) ON CONFLICT DO NOTHING;
+        """)
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+            BEGIN
+                UPDATE catalog_version SET version = version + 1;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+        """)
+        listed = ", ".join(c for c in DRUG_LIST_COLUMNS if c != "id")
+        cur.execute("DROP TRIGGER IF EXISTS meds_catalog_version ON meds;")
+        cur.execute(f"""
+            CREATE TRIGGER meds_catalog_version
+            AFTER INSERT OR UPDATE OF {listed} OR DELETE OR TRUNCATE ON meds
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+        """)
+    conn.commit()
+    conn.close()
+
+def get_catalog_version() -> int:
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM catalog_version;")
+        row = cur.fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+def list_drugs_page(filters: dict, fields: list, after_id: int = 0, limit: int = 50):
+    """
+    One keyset page: rows with id > after_id matching `filters`, ordered by id.
+    Column names must come from DRUG_FILTER_COLUMNS / DRUG_LIST_COLUMNS (checked by the caller).
+    Returns (rows as dicts, has_more).
+    """
+    cols = ["id"] + [f for f in fields if f != "id"]
+    where = ["id > %s"]
+    params = [after_id]
+    for col, value in filters.items():
+        where.append(f"{col} = %s")
+        params.append(value)
+    params.append(limit + 1)
+
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT {", ".join(cols)}
+            FROM meds
+            WHERE {" AND ".join(where)}
+            ORDER BY id
+            LIMIT %s;
+        """, params)
+        rows = cur.fetchall()
+    conn.close()
+    return [dict(zip(cols, row)) for row in rows[:limit]], len(rows) > limit
+
 # -------------------------------
 # MAIN
 # -------------------------------
@@ -262,6 +488,7 @@ if __name__ == "__main__":
 
     # PostgreSQL
     create_postgres_table()
+    create_catalog_indexes()
     seed_postgres_examples()
     test_postgres_connection()
     update_embeddings()
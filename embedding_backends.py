@@ -0,0 +1,206 @@
+# embedding_backends.py
+# Pluggable CPU inference backends for the embedding models.
+# Run: python embedding_backends.py export [model]   -> writes the ONNX graph (+ int8 copy)
+#      python embedding_backends.py parity [model]   -> cosine agreement vs the PyTorch model
+import csv
+import os
+import time
+from typing import List
+
+import numpy as np
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# ---------- General settings ----------
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "BAAI/bge-small-en")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")          # "torch" | "onnx"
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "onnx_models")
+EMBEDDING_INT8 = os.getenv("EMBEDDING_INT8", "0") == "1"
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))         # 0 = runtime default
+PARITY_MIN_COSINE = 0.99
+
+CATALOG_CSV = "bariatric_meds_export.csv"
+
+
+class TorchBackend:
+    """
+    Reference backend: SentenceTransformer on PyTorch.
+    """
+    name = "torch"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, num_threads: int = EMBEDDING_THREADS):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime backend for an exported BERT-style encoder
+    (CLS pooling + L2 normalization, matching the BGE sentence-transformers config).
+    Does not import torch, which keeps RSS and startup time down.
+    """
+    name = "onnx"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, onnx_dir: str = EMBEDDING_ONNX_DIR,
+                 int8: bool = EMBEDDING_INT8, num_threads: int = EMBEDDING_THREADS, max_length: int = 512):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = onnx_model_dir(model_name, onnx_dir)
+        graph = os.path.join(model_dir, "model.int8.onnx" if int8 else "model.onnx")
+        if not os.path.exists(graph):
+            raise FileNotFoundError(f"{graph} not found; run `python embedding_backends.py export` first")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(graph, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.model_name = model_name
+        self.int8 = int8
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(list(texts))
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+        }
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        last_hidden = self.session.run(None, feeds)[0]
+        cls = last_hidden[:, 0]
+        return cls / np.linalg.norm(cls, axis=1, keepdims=True)
+
+
+def onnx_model_dir(model_name: str = EMBEDDING_MODEL, onnx_dir: str = EMBEDDING_ONNX_DIR) -> str:
+    return os.path.join(onnx_dir, model_name.replace("/", "__"))
+
+
+def load_backend(kind: str = EMBEDDING_BACKEND, model_name: str = EMBEDDING_MODEL, **kwargs):
+    """
+    Build the configured backend. Every backend exposes `encode(texts) -> np.ndarray`
+    of L2-normalized vectors, so callers don't care which one is loaded.
+    """
+    start = time.perf_counter()
+    if kind == "torch":
+        backend = TorchBackend(model_name, **kwargs)
+    elif kind == "onnx":
+        backend = OnnxBackend(model_name, **kwargs)
+    else:
+        raise ValueError(f"Unknown embedding backend '{kind}' (expected 'torch' or 'onnx')")
+    logger.info("embedding backend loaded", extra={"backend": kind, "model": model_name,
+                                                   "load_s": round(time.perf_counter() - start, 2)})
+    return backend
+
+
+# -------------------------------
+# Export
+# -------------------------------
+def export_onnx(model_name: str = EMBEDDING_MODEL, onnx_dir: str = EMBEDDING_ONNX_DIR, quantize: bool = True) -> str:
+    """
+    Export the HF encoder to ONNX (dynamic batch/sequence axes) and,
+    optionally, write a dynamically int8-quantized copy next to it.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    out_dir = onnx_model_dir(model_name, onnx_dir)
+    os.makedirs(out_dir, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(out_dir)  # writes tokenizer.json (fast tokenizer)
+
+    sample = tokenizer(["SafeMeds export sample"], return_tensors="pt")
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    dynamic_axes = {n: {0: "batch", 1: "sequence"} for n in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    graph = os.path.join(out_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(sample[n] for n in input_names), graph,
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes, opset_version=17,
+        )
+    print(f"✅ Exported {model_name} to {graph}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_graph = os.path.join(out_dir, "model.int8.onnx")
+        quantize_dynamic(graph, int8_graph, weight_type=QuantType.QInt8)
+        print(f"✅ Wrote int8 model to {int8_graph}")
+    return out_dir
+
+
+# -------------------------------
+# Parity check
+# -------------------------------
+def catalog_texts(csv_path: str = CATALOG_CSV) -> List[str]:
+    """
+    Texts embedded for the catalog, in the same shape db.update_embeddings uses.
+    Reads the SQLite CSV export so the check runs without a Postgres connection.
+    """
+    with open(csv_path, encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    return [f"{r['drug_name']} ({r['generic_name']}) - {r['indication']}" for r in rows]
+
+
+def parity_check(candidate, reference=None, texts: List[str] = None) -> dict:
+    """
+    Cosine agreement between `candidate` and the PyTorch reference model,
+    row by row over the catalog texts.
+    """
+    texts = texts or catalog_texts()
+    reference = reference or TorchBackend(candidate.model_name)
+    ref = reference.encode(texts)
+    got = candidate.encode(texts)
+    cosines = np.sum(ref * got, axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(got, axis=1))
+    report = {
+        "backend": candidate.name,
+        "int8": getattr(candidate, "int8", False),
+        "texts": len(texts),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "ok": bool(cosines.min() >= PARITY_MIN_COSINE),
+    }
+    if not report["ok"]:
+        worst = int(cosines.argmin())
+        logger.warning("embedding parity below threshold", extra={"min_cosine": report["min_cosine"],
+                                                                  "text": texts[worst]})
+    return report
+
+
+# -------------------------------
+# MAIN
+# -------------------------------
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "parity"
+    model_name = sys.argv[2] if len(sys.argv) > 2 else EMBEDDING_MODEL
+    if command == "export":
+        export_onnx(model_name)
+    elif command == "parity":
+        reference = TorchBackend(model_name)
+        for int8 in (False, True):
+            print(parity_check(OnnxBackend(model_name, int8=int8), reference=reference))
+    else:
+        print("Usage: python embedding_backends.py [export|parity] [model]")
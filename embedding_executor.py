@@ -0,0 +1,159 @@
+# embedding_executor.py
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Sequence
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# ---------- General settings ----------
+MAX_BATCH_SIZE = 32     # Upper bound of texts per model.encode call
+MAX_WAIT_MS = 5         # How long the first request in a batch waits for company (skipped when idle)
+MAX_QUEUE_SIZE = 1024   # Pending texts before callers get EmbeddingQueueFull
+
+_STOP = object()
+
+
+class EmbeddingQueueFull(RuntimeError):
+    """
+    Raised when the executor queue is full (backpressure signal to callers).
+    """
+
+
+class EmbeddingExecutor:
+    """
+    Runs a CPU-bound encode function on a dedicated worker thread.
+    Concurrent requests are collected into micro-batches bounded by
+    `max_batch_size` and `max_wait_ms`, and each caller gets a Future
+    for its own vector.
+
+    A lone request with nothing queued behind it, right after a batch of
+    one, is encoded at once: waiting only pays off under concurrency, and at
+    a single caller it would add `max_wait_ms` to every request.
+
+    `encode_fn(texts)` must return one vector per input text, in order.
+    """
+    def __init__(self, encode_fn: Callable[[List[str]], Sequence], max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait_ms: float = MAX_WAIT_MS, max_queue_size: int = MAX_QUEUE_SIZE,
+                 name: str = "embedding-worker"):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Stats
+        self.batches = 0
+        self.encoded = 0
+        self.rejected = 0
+        self._last_batch_size = 0
+
+    # ---------- Public API ----------
+    def submit(self, text: str, timeout: Optional[float] = 0.0) -> Future:
+        """
+        Queue one text. `timeout=0` rejects immediately when the queue is full,
+        `None` blocks until there is room.
+        """
+        self._ensure_started()
+        future: Future = Future()
+        try:
+            if timeout == 0:
+                self._queue.put_nowait((text, future))
+            else:
+                self._queue.put((text, future), timeout=timeout)
+        except queue.Full:
+            self.rejected += 1
+            raise EmbeddingQueueFull(f"{self.name}: {self._queue.qsize()} texts pending")
+        return future
+
+    def encode(self, texts: List[str], timeout: Optional[float] = None) -> List:
+        """
+        Blocking helper: embed a list of texts through the shared worker.
+        """
+        futures = [self.submit(t, timeout=timeout) for t in texts]
+        return [f.result() for f in futures]
+
+    async def embed(self, text: str, timeout: Optional[float] = 0.0):
+        """
+        Awaitable version of `submit` for async endpoints; never blocks the loop.
+        """
+        return await asyncio.wrap_future(self.submit(text, timeout=timeout))
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "encoded": self.encoded,
+            "avg_batch_size": round(self.encoded / self.batches, 2) if self.batches else 0.0,
+            "rejected": self.rejected,
+            "queue_depth": self.queue_depth(),
+        }
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        if wait:
+            thread.join()
+
+    # ---------- Worker ----------
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _collect(self, first) -> tuple:
+        """
+        Gather up to max_batch_size items, waiting at most max_wait after the first.
+        Returns (batch, stop_requested).
+        """
+        batch = [first]
+        if self._queue.empty() and self._last_batch_size <= 1:
+            return batch, False  # idle: nobody to wait for
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch, stop = self._collect(item)
+            self._last_batch_size = len(batch)
+            batch = [(text, fut) for text, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self.encode_fn(texts)
+            except Exception as e:
+                logger.error("%s: encode failed for batch of %d: %s", self.name, len(texts), e)
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.encoded += len(texts)
+            for (_, fut), vector in zip(batch, vectors):
+                fut.set_result(vector)
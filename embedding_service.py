@@ -1,11 +1,20 @@
-from sentence_transformers import SentenceTransformer
+from embedding_backends import load_backend
+from embedding_executor import EmbeddingExecutor
 
-# تحميل الموديل من HuggingFace
-model = SentenceTransformer("BAAI/bge-small-en")  
+# تحميل الموديل (PyTorch أو ONNX حسب EMBEDDING_BACKEND)
+model = load_backend(model_name="BAAI/bge-small-en")
+
+# الموديل بيشتغل في thread لوحده وبيجمع الطلبات المتزامنة في batches
+executor = EmbeddingExecutor(model.encode)
 
 def get_embeddings(texts):
     """
     ترجع الـ embeddings لقائمة من النصوص
     """
-    embeddings = model.encode(texts, convert_to_tensor=True)
-    return embeddings
+    return executor.encode(list(texts))
+
+async def get_embeddings_async(text):
+    """
+    نفس الفكرة بس awaitable لنص واحد، من غير ما توقف الـ event loop
+    """
+    return await executor.embed(text)
@@ -1,16 +1,283 @@
+import atexit
+import contextvars
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import time
+from typing import Dict, Optional
 
+# ======================
+#   Logging Settings
+# ======================
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_SECONDS = int(os.getenv("LOG_ROTATE_SECONDS", str(24 * 60 * 60)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "7"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# How long a WARNING+ record may wait for room in a full queue
+LOG_BLOCK_TIMEOUT_S = float(os.getenv("LOG_BLOCK_TIMEOUT_S", "1.0"))
+# Per-logger sampling for DEBUG records, e.g. "backend=0.1,db=0.01"
+LOG_DEBUG_SAMPLING = os.getenv("LOG_DEBUG_SAMPLING", "")
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+# Fields passed through `extra=` that may hold user health text
+REDACTED_FIELDS = {"query", "message", "history", "prompt", "answer"}
 
-logger = logging.getLogger(__name__)
+_SECRET_PATTERNS = [
+    re.compile(r"AIza[0-9A-Za-z_\-]{35}"),        # Google API keys
+    re.compile(r"(key=)[^&\s\"']+"),              # keys in query strings
+]
 
-def my_function():
-    logger.info("Function started")
-    logger.warning("This is a warning")
-    logger.error("Something went wrong")
+# Attributes every LogRecord has; anything else came from `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
 
-my_function()
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+
+def set_request_id(request_id: str):
+    """
+    Bind a request id to the current thread / task. Returns a token for reset.
+    """
+    return request_id_var.set(request_id)
+
+
+def reset_request_id(token):
+    request_id_var.reset(token)
+
+
+def redact(text: str) -> str:
+    """
+    Mask API keys (env value and anything shaped like one) in a string.
+    """
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if api_key:
+        text = text.replace(api_key, "[REDACTED]")
+    for pattern in _SECRET_PATTERNS:
+        text = pattern.sub(lambda m: (m.group(1) if m.groups() else "") + "[REDACTED]", text)
+    return text
+
+
+# ======================
+#   Filters
+# ======================
+class RequestIdFilter(logging.Filter):
+    """
+    Stamp each record with the request id of the calling context.
+    Must run on the producer side (before the queue) to see the right context.
+    """
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of DEBUG records for the configured loggers.
+    Records at INFO and above are never dropped.
+    """
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or not self.rates:
+            return True
+        rate = self.rates.get(record.name)
+        if rate is None:
+            return True
+        return random.random() < rate
+
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    rates = {}
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        name, rate = part.split("=", 1)
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+# ======================
+#   Formatter
+# ======================
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line. Runs in the listener thread, so redaction
+    and serialization cost stay off the request path.
+    """
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+                  + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": redact(record.getMessage()),
+        }
+        for key, value in record.__dict__.items():
+            if key in _RECORD_ATTRS or key == "request_id":
+                continue
+            if key in REDACTED_FIELDS:
+                entry[key] = f"[REDACTED len={len(str(value))}]"
+            else:
+                entry[key] = value if isinstance(value, (int, float, bool)) or value is None else redact(str(value))
+        if record.exc_text:
+            entry["exc"] = redact(record.exc_text)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# ======================
+#   Handlers
+# ======================
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Rotate when the file grows past `maxBytes` or every `interval` seconds,
+    whichever comes first.
+    """
+    def __init__(self, filename, maxBytes=0, backupCount=0, interval=0, encoding="utf-8"):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding)
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval else None
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that doesn't block the caller on routine records: when the
+    queue is full, DEBUG/INFO records are dropped and counted. WARNING and
+    above wait up to `block_timeout` for the writer thread instead, and are
+    only counted as dropped if it is stuck for that long.
+    """
+    def __init__(self, q, block_timeout: float = LOG_BLOCK_TIMEOUT_S):
+        super().__init__(q)
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self.dropped_warnings = 0
+
+    def prepare(self, record):
+        # Cheaper than the default (which runs a full Formatter): only merge
+        # args so the record is picklable and safe to hand to another thread.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            if record.levelno < logging.WARNING:
+                self.dropped += 1
+                return
+        try:
+            self.queue.put(record, timeout=self.block_timeout)
+        except queue.Full:
+            self.dropped += 1
+            self.dropped_warnings += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def setup_logging(level: str = LOG_LEVEL, log_file: Optional[str] = LOG_FILE, sampling: str = LOG_DEBUG_SAMPLING,
+                  console: bool = True):
+    """
+    Configure the root logger once for the whole app.
+    Producers only enqueue; a background QueueListener does formatting and I/O.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _queue_handler
+
+    formatter = JsonFormatter()
+    handlers = []
+    if log_file:
+        file_handler = SizeAndTimeRotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, interval=LOG_ROTATE_SECONDS
+        )
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    if console:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+        handlers.append(stream_handler)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _queue_handler.addFilter(RequestIdFilter())
+    _queue_handler.addFilter(SamplingFilter(parse_sampling(sampling)))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(_queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _queue_handler
+
+
+def shutdown_logging():
+    """
+    Flush pending records and stop the background writer.
+    """
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    for h in _listener.handlers:
+        h.close()
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener = None
+    _queue_handler = None
+
+
+def logging_stats() -> dict:
+    """
+    Queue depth and drop counters of the logging pipeline (for /metrics).
+    """
+    if _queue_handler is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "queued": _queue_handler.queue.qsize(),
+        "queue_size": _queue_handler.queue.maxsize,
+        "dropped": _queue_handler.dropped,
+        "dropped_warnings": _queue_handler.dropped_warnings,
+    }
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
+
+if __name__ == "__main__":
+    setup_logging(level="DEBUG")
+    logger = get_logger("APP")
+    token = set_request_id("demo-request")
+    logger.debug("دي رسالة Debug – للتفاصيل الدقيقة أثناء التطوير")
+    logger.info("دي رسالة Info – معلومات عادية", extra={"query": "عندي صداع"})
+    logger.warning("دي رسالة Warning – تحذير محتمل")
+    logger.error("دي رسالة Error – حصل خطأ")
+    reset_request_id(token)
@@ -0,0 +1,192 @@
+# profiling.py
+# Opt-in sampling profiler (collapsed stacks for flamegraphs) and tracemalloc snapshots.
+import functools
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable, List, Optional, Set
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# ---------- General settings ----------
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")             # unset = profiling endpoints/headers disabled
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+MAX_WINDOW_S = 120
+TRACEMALLOC_FRAMES = 10
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    """
+    Profiling is off unless PROFILING_TOKEN is set and the caller presents it
+    (constant-time comparison).
+    """
+    if not PROFILING_TOKEN or token is None:
+        return False
+    return hmac.compare_digest(token.encode(), PROFILING_TOKEN.encode())
+
+
+class SamplingProfiler:
+    """
+    Samples Python stacks every `interval_ms` from a background thread using
+    sys._current_frames(), and aggregates them as collapsed stacks
+    ("outer;inner;leaf count"), the input format of flamegraph.pl / speedscope.
+
+    With `all_threads=False` only threads registered through `track()` are
+    sampled, which scopes a profile to one request.
+    """
+    def __init__(self, interval_ms: float = SAMPLE_INTERVAL_MS, all_threads: bool = True):
+        self.interval = interval_ms / 1000
+        self.threads: Optional[Set[int]] = None if all_threads else set()
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at = 0.0
+        self.elapsed = 0.0
+
+    def start(self) -> "SamplingProfiler":
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def finish(self, name: str) -> str:
+        """
+        stop() + write(): both block (thread join, file I/O), so async
+        callers should run this with asyncio.to_thread.
+        """
+        return self.stop().write(name)
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def track(self, fn: Callable) -> Callable:
+        """
+        Wrap `fn` so the thread that runs it is sampled while it runs.
+        """
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            ident = threading.get_ident()
+            if self.threads is not None:
+                self.threads.add(ident)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if self.threads is not None:
+                    self.threads.discard(ident)
+        return wrapper
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (self.threads is not None and ident not in self.threads):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.counts[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    # ---------- Output ----------
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.counts.most_common())
+
+    def top(self, n: int = 10) -> List[dict]:
+        """
+        Functions with the most samples at the top of the stack (self time).
+        """
+        leaves: Counter = Counter()
+        for stack, count in self.counts.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [{"function": f, "samples": c, "pct": round(100 * c / total, 1)} for f, c in leaves.most_common(n)]
+
+    def write(self, name: str) -> str:
+        """
+        Write the collapsed stacks to PROFILE_DIR/<name>-<timestamp>.collapsed and return the path.
+        """
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed() + "\n")
+        logger.info("profile written", extra={"path": path, "samples": self.samples,
+                                              "elapsed_s": round(self.elapsed, 3)})
+        return path
+
+
+def request_profiler(header_value: Optional[str]) -> Optional[SamplingProfiler]:
+    """
+    Per-request hook: an `X-Profile: <PROFILING_TOKEN>` header returns a started
+    profiler scoped to the request's threads. Without it this is a single
+    comparison, so the cost with profiling off is negligible.
+    """
+    if header_value is None or not is_authorized(header_value):
+        return None
+    return SamplingProfiler(all_threads=False).start()
+
+
+# -------------------------------
+# Memory snapshots
+# -------------------------------
+_last_snapshot: Optional[tracemalloc.Snapshot] = None
+_snapshot_lock = threading.Lock()
+
+
+def start_tracemalloc(frames: int = TRACEMALLOC_FRAMES):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def stop_tracemalloc():
+    global _last_snapshot
+    tracemalloc.stop()
+    _last_snapshot = None
+
+
+def memory_report(top_n: int = 20) -> dict:
+    """
+    Top-N allocation sites by size, plus growth since the previous report
+    (call it twice under load to see what keeps growing).
+    """
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        return {"tracing": False}
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    with _snapshot_lock:
+        previous, _last_snapshot = _last_snapshot, snapshot
+    current, peak = tracemalloc.get_traced_memory()
+    report = {
+        "tracing": True,
+        "current_mb": round(current / 1e6, 2),
+        "peak_mb": round(peak / 1e6, 2),
+        "top": [{"site": str(s.traceback[0]), "size_kb": round(s.size / 1024, 1), "count": s.count}
+                for s in snapshot.statistics("lineno")[:top_n]],
+    }
+    if previous is not None:
+        report["growth"] = [{"site": str(d.traceback[0]), "size_diff_kb": round(d.size_diff / 1024, 1),
+                             "count_diff": d.count_diff}
+                            for d in snapshot.compare_to(previous, "lineno")[:top_n] if d.size_diff > 0]
+    return report
@@ -1,7 +1,8 @@
 # rag_core.py (modified to work with DB only)
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
 from db import search_drug  # Function that fetches drug data from PostgreSQL
+from chunk_store import store as chunk_store, build_chunks, pick_chunks, select_fields
 
 # ---------- General settings ----------
 TOP_K = 5  # Number of reference results (in case we want multiple)
@@ -30,33 +31,28 @@ class RetrievedChunk:
     score: float | None = None  # Can be used if vector similarity is added later
 
 # ---------- Data retrieval from DB ----------
-def retrieve_context(drug_name: str, top_k: int = TOP_K) -> List[RetrievedChunk]:
+def retrieve_context(query: str, top_k: int = TOP_K, fields: Optional[List[str]] = None) -> List[RetrievedChunk]:
     """
-    Retrieve drug information from the database and return it as RetrievedChunk objects.
-    Currently fetches by exact drug name (via search_drug).
+    Retrieve drug information as RetrievedChunk objects from the precomputed chunk store.
+    `query` is a drug name or a question naming one drug ("ايه جرعة Ibuprofen").
+    With `fields`, only those field chunks are returned (smaller prompts);
+    otherwise the whole-drug summary chunk.
+    Falls back to the meds table (exact name via search_drug) for drugs not chunked yet.
     """
-    data = search_drug(drug_name)
-    if not data:
-        return []
-
-    # Format all drug fields into a structured text block
-    chunk_text = (
-        f"Drug Name: {data['drug_name']}\n"
-        f"Generic: {data['generic_name']}\n"
-        f"Class: {data['drug_class']}\n"
-        f"Indication: {data['indication']}\n"
-        f"Status After Sleeve: {data['status_after_sleeve']}\n"
-        f"Reason: {data['reason']}\n"
-        f"Dose Adjustment: {data['dose_adjustment_notes']}\n"
-        f"Form: {data['administration_form']}\n"
-        f"Notes: {data['notes']}\n"
-    )
+    drug_id = chunk_store.resolve_drug(query)
+    if drug_id is not None:
+        chunks = chunk_store.drug_chunks(drug_id, fields)
+    else:
+        data = search_drug(query)
+        if not data:
+            return []
+        chunks = pick_chunks({c.field: c for c in build_chunks(data)}, fields)
 
     return [RetrievedChunk(
-        id=data['drug_name'],
-        text=chunk_text,
+        id=c.id,
+        text=c.text,
         source="SafeMeds DB"
-    )]
+    ) for c in chunks[:top_k]]
 
 # ---------- Answer generation ----------
 def answer_question(question: str, top_k: int = TOP_K) -> Dict[str, Any]:
@@ -66,7 +62,7 @@ def answer_question(question: str, top_k: int = TOP_K) -> Dict[str, Any]:
     - If nothing is found, returns a fallback message
     - Otherwise, compiles the drug information into an answer
     """
-    chunks = retrieve_context(question, top_k=top_k)
+    chunks = retrieve_context(question, top_k=top_k, fields=select_fields(question))
 
     if not chunks:
         return {
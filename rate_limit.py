@@ -0,0 +1,46 @@
+# rate_limit.py
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`.
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """
+        Take `tokens` if available right now; never waits.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """
+        Seconds until `tokens` would be available (0 if they are now).
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = tokens - self.tokens
+            return max(0.0, missing / self.rate) if self.rate else float("inf")
+
+    def acquire(self, tokens: float = 1.0):
+        """
+        Block until `tokens` are available, then take them.
+        """
+        while not self.try_acquire(tokens):
+            time.sleep(max(self.wait_time(tokens), 0.001))
@@ -0,0 +1,195 @@
+# semantic_cache.py
+# Reuse LLM answers for paraphrased questions about the same drugs.
+import hashlib
+import itertools
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+audit_logger = get_logger("semantic_cache.audit")
+
+# ---------- General settings ----------
+SIMILARITY_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+CAPACITY = int(os.getenv("SEMANTIC_CACHE_CAPACITY", "2000"))
+BORDERLINE_MARGIN = 0.03  # hits this close to the threshold are flagged for review
+
+_ARABIC_DIACRITICS = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_LETTER_MAP = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي", "ة": "ه", "ؤ": "و", "ئ": "ي"})
+
+
+def normalize_question(text: str) -> str:
+    """
+    Fold the spelling variations users type for the same question:
+    tashkeel/tatweel, alef/yaa/taa-marbuta forms, punctuation, case and spacing.
+    """
+    text = _ARABIC_DIACRITICS.sub("", text.lower())
+    text = text.translate(_LETTER_MAP)
+    text = _PUNCTUATION.sub(" ", text)
+    return " ".join(text.split())
+
+
+def context_fingerprint(context: str) -> str:
+    """
+    Hash of the retrieved context an answer was generated from.
+    If a `meds` row changes, its context changes and old answers stop matching.
+    """
+    return hashlib.sha1(context.encode()).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    id: int
+    question: str
+    answer: str
+    scope: Tuple
+    fingerprint: str
+    vector: np.ndarray = field(repr=False)
+    hits: int = 0
+
+
+class SemanticCache:
+    """
+    LRU cache of answered questions, searched by embedding similarity.
+
+    Entries are partitioned by (scope, fingerprint): the ids of the drugs
+    retrieved for the question plus the hash of the context the answer was
+    generated from. A lookup only compares against questions answered from
+    the same drugs and the same context, via a cosine scan over a small
+    per-partition matrix. Different contexts over the same drugs (e.g. a
+    symptom mapped to one drug vs. a direct question about it) coexist;
+    partitions for an outdated context simply stop matching and age out.
+
+    Unscoped questions (scope `()`, nothing retrieved) are never cached:
+    they all share one context, so two questions that differ only in the
+    drug they name would match each other.
+    """
+    def __init__(self, embed_fn: Callable[[str], Sequence[float]], threshold: float = SIMILARITY_THRESHOLD,
+                 capacity: int = CAPACITY):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.capacity = capacity
+        self._entries: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        self._partitions: Dict[Tuple, List[int]] = {}   # (scope, fingerprint) -> entry ids
+        self._matrices: Dict[Tuple, np.ndarray] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.false_hits = 0
+
+    # ---------- Public API ----------
+    def embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embed_fn(normalize_question(question)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, question: str, scope: Tuple, fingerprint: str,
+            vector: Optional[np.ndarray] = None) -> Optional[CacheEntry]:
+        """
+        Return the best cached entry for `question` answered from the same
+        `scope` and context `fingerprint` whose similarity clears the
+        threshold, or None.
+        """
+        if not scope:
+            return None
+        vector = self.embed(question) if vector is None else vector
+        key = (scope, fingerprint)
+        with self._lock:
+            ids = self._partitions.get(key)
+            if not ids:
+                self.misses += 1
+                return None
+            scores = self._matrix(key) @ vector
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            entry = self._entries[ids[best]]
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry.id)
+            entry.hits += 1
+            self.hits += 1
+            if (self.hits + self.misses) % 100 == 0:
+                audit_logger.info("semantic cache stats", extra=self.stats())
+
+        audit_logger.info("semantic cache hit", extra={
+            "entry_id": entry.id,
+            "similarity": round(similarity, 4),
+            "borderline": similarity < self.threshold + BORDERLINE_MARGIN,
+            "scope": str(scope),
+            "query": question,
+            "cached_question_hash": hashlib.sha1(entry.question.encode()).hexdigest()[:12],
+        })
+        return entry
+
+    def set(self, question: str, answer: str, scope: Tuple, fingerprint: str,
+            vector: Optional[np.ndarray] = None) -> Optional[int]:
+        if not scope:
+            return None
+        vector = self.embed(question) if vector is None else vector
+        with self._lock:
+            entry = CacheEntry(next(self._ids), question, answer, scope, fingerprint, vector)
+            self._entries[entry.id] = entry
+            key = (scope, fingerprint)
+            self._partitions.setdefault(key, []).append(entry.id)
+            self._matrices.pop(key, None)
+            while len(self._entries) > self.capacity:
+                oldest_id = next(iter(self._entries))
+                self._remove(oldest_id)
+        return entry.id
+
+    def report_false_hit(self, entry_id: int) -> bool:
+        """
+        Mark a served answer as wrong for the question it was matched to
+        (user feedback on /chat) and evict it. Returns False for an unknown
+        or already evicted entry, which is not counted.
+        """
+        with self._lock:
+            if entry_id not in self._entries:
+                return False
+            self.false_hits += 1
+            self._remove(entry_id)
+        audit_logger.warning("semantic cache false hit", extra={"entry_id": entry_id,
+                                                                "false_hits": self.false_hits})
+        return True
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "false_hits": self.false_hits,
+            "false_hit_rate": round(self.false_hits / self.hits, 4) if self.hits else 0.0,
+        }
+
+    # ---------- Internals (call with lock held) ----------
+    def _matrix(self, key: Tuple) -> np.ndarray:
+        matrix = self._matrices.get(key)
+        if matrix is None:
+            matrix = np.stack([self._entries[eid].vector for eid in self._partitions[key]])
+            self._matrices[key] = matrix
+        return matrix
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        key = (entry.scope, entry.fingerprint)
+        ids = self._partitions.get(key, [])
+        if entry_id in ids:
+            ids.remove(entry_id)
+        if not ids:
+            self._partitions.pop(key, None)
+        self._matrices.pop(key, None)
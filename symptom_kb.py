@@ -0,0 +1,299 @@
+# symptom_kb.py
+# Symptom knowledge base: keyword/drug mappings live in the DB and are compiled
+# into an immutable in-memory snapshot that is hot-swapped when anything changes.
+# Run: python symptom_kb.py   -> create the tables and seed the default mappings
+import os
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from db import create_catalog_indexes, get_connection
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# ---------- General settings ----------
+RELOAD_INTERVAL_S = float(os.getenv("SYMPTOM_KB_RELOAD_S", "30"))
+DEFAULT_ADVICE = "It seems you have {symptom}. Try resting, stay hydrated, and consult a doctor if symptoms persist."
+
+# Initial content of the tables (formerly hard-coded in backend.py)
+SEED_KEYWORDS = {
+    "وجع المعدة": ["وجع", "بطن", "معدة", "حرقة", "ألم في البطن"],
+    "صداع": ["صداع", "راس وجع", "وجع راس"],
+    "قيء": ["ترجيع", "سخنية", "غثيان"],
+    "إسهال": ["اسهال", "إسهال", "إسهال مائي"],
+    "تعب": ["تعب", "ارهاق", "ضعف"],
+    "تنميل": ["تنميل", "وخز", "خدر"],
+}
+SEED_DRUGS = {
+    "وجع المعدة": ["Omeprazole", "Pantoprazole", "Ranitidine"],
+    "صداع": ["Paracetamol", "Ibuprofen", "Aspirin"],
+    "قيء": ["Metoclopramide", "Domperidone"],
+    "إسهال": ["Loperamide", "Oral Rehydration Salt"],
+    "تعب": ["Multivitamins", "Iron Supplement", "Vitamin B Complex"],
+    "تنميل": ["Vitamin B Complex", "Magnesium"],
+}
+
+
+# -------------------------------
+# DB tables
+# -------------------------------
+def create_symptom_tables():
+    """
+    Create the symptom tables and a version counter bumped by triggers on them.
+    Also ensures meds' catalog_version exists, since context blocks join meds.
+    """
+    create_catalog_indexes()
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS symptoms (
+            id SERIAL PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL,
+            position INTEGER DEFAULT 0,
+            advice TEXT
+        );
+        CREATE TABLE IF NOT EXISTS symptom_keywords (
+            symptom_id INTEGER REFERENCES symptoms(id) ON DELETE CASCADE,
+            keyword TEXT NOT NULL,
+            position INTEGER DEFAULT 0,
+            PRIMARY KEY (symptom_id, keyword)
+        );
+        CREATE TABLE IF NOT EXISTS symptom_drugs (
+            symptom_id INTEGER REFERENCES symptoms(id) ON DELETE CASCADE,
+            drug_name TEXT NOT NULL,
+            position INTEGER DEFAULT 0,
+            PRIMARY KEY (symptom_id, drug_name)
+        );
+        CREATE TABLE IF NOT EXISTS symptom_kb_version (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            version BIGINT NOT NULL
+        );
+        INSERT INTO symptom_kb_version (id, version) VALUES (TRUE, 1) ON CONFLICT DO NOTHING;
+        """)
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION bump_symptom_kb_version() RETURNS trigger AS $$
+            BEGIN
+                UPDATE symptom_kb_version SET version = version + 1;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+        """)
+        for table in ("symptoms", "symptom_keywords", "symptom_drugs"):
+            cur.execute(f"DROP TRIGGER IF EXISTS {table}_kb_version ON {table};")
+            cur.execute(f"""
+                CREATE TRIGGER {table}_kb_version
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_symptom_kb_version();
+            """)
+    conn.commit()
+    conn.close()
+
+
+def seed_symptom_kb():
+    """
+    Insert the default mappings (existing rows are left alone).
+    """
+    conn = get_connection()
+    with conn.cursor() as cur:
+        for position, (symptom, keywords) in enumerate(SEED_KEYWORDS.items()):
+            cur.execute("""
+                INSERT INTO symptoms (name, position) VALUES (%s, %s)
+                ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+                RETURNING id;
+            """, (symptom, position))
+            symptom_id = cur.fetchone()[0]
+            cur.executemany("""
+                INSERT INTO symptom_keywords (symptom_id, keyword, position) VALUES (%s, %s, %s)
+                ON CONFLICT DO NOTHING;
+            """, [(symptom_id, kw, i) for i, kw in enumerate(keywords)])
+            cur.executemany("""
+                INSERT INTO symptom_drugs (symptom_id, drug_name, position) VALUES (%s, %s, %s)
+                ON CONFLICT DO NOTHING;
+            """, [(symptom_id, drug, i) for i, drug in enumerate(SEED_DRUGS.get(symptom, []))])
+    conn.commit()
+    conn.close()
+
+
+def get_versions() -> Tuple[int, int]:
+    """
+    (symptom_kb_version, catalog_version): a snapshot is current while both match.
+    """
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT (SELECT version FROM symptom_kb_version),
+                   (SELECT version FROM catalog_version);
+        """)
+        row = cur.fetchone()
+    conn.close()
+    return row[0], row[1]
+
+
+# -------------------------------
+# Snapshot
+# -------------------------------
+@dataclass(frozen=True)
+class SymptomSnapshot:
+    """
+    Immutable, fully precomputed view of the knowledge base.
+    """
+    versions: Tuple[int, int]
+    keywords: Tuple[Tuple[str, Tuple[str, ...]], ...]   # (symptom, keywords) in priority order
+    contexts: Mapping[str, str]                            # symptom -> ready-to-use CONTEXT block
+    scopes: Mapping[str, Tuple]                            # symptom -> drug ids (semantic cache scope)
+
+    def match(self, user_input: str) -> Optional[str]:
+        user_input = user_input.lower()
+        for symptom, keywords in self.keywords:
+            for kw in keywords:
+                if kw in user_input:
+                    return symptom
+        return None
+
+
+def build_context(symptom: str, meds_info: List[str], advice: Optional[str]) -> str:
+    if meds_info:
+        return f"Regarding {symptom}, suitable medications:\n- " + "\n- ".join(meds_info)
+    return (advice or DEFAULT_ADVICE).format(symptom=symptom)
+
+
+def load_snapshot() -> SymptomSnapshot:
+    """
+    Read the mappings and join them against meds once, producing every
+    symptom's context block up front.
+    """
+    versions = get_versions()
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT s.name, s.advice, k.keyword
+            FROM symptoms s LEFT JOIN symptom_keywords k ON k.symptom_id = s.id
+            ORDER BY s.position, s.id, k.position, k.keyword;
+        """)
+        keyword_rows = cur.fetchall()
+        cur.execute("""
+            SELECT s.name, m.id, m.drug_name, m.generic_name, m.indication
+            FROM symptom_drugs d
+            JOIN symptoms s ON s.id = d.symptom_id
+            JOIN meds m ON LOWER(m.drug_name) = LOWER(d.drug_name)
+                        OR LOWER(m.generic_name) = LOWER(d.drug_name)
+            ORDER BY s.id, d.position;
+        """)
+        drug_rows = cur.fetchall()
+    conn.close()
+
+    keywords: Dict[str, List[str]] = {}
+    advice: Dict[str, Optional[str]] = {}
+    for name, symptom_advice, keyword in keyword_rows:
+        keywords.setdefault(name, [])
+        advice[name] = symptom_advice
+        if keyword:
+            keywords[name].append(keyword)
+
+    meds_info: Dict[str, List[str]] = {}
+    drug_ids: Dict[str, List[int]] = {}
+    for name, drug_id, drug_name, generic_name, indication in drug_rows:
+        if drug_id in drug_ids.get(name, []):
+            continue  # matched by both name and generic name
+        drug_ids.setdefault(name, []).append(drug_id)
+        meds_info.setdefault(name, []).append(f"{drug_name} ({generic_name}): {indication}")
+
+    return SymptomSnapshot(
+        versions=versions,
+        keywords=tuple((name, tuple(kws)) for name, kws in keywords.items()),
+        contexts=MappingProxyType({name: build_context(name, meds_info.get(name, []), advice[name])
+                                   for name in keywords}),
+        scopes=MappingProxyType({name: tuple(sorted(drug_ids.get(name, []))) or ("symptom", name)
+                                 for name in keywords}),
+    )
+
+
+def seed_snapshot() -> SymptomSnapshot:
+    """
+    DB-less fallback built from the seed mappings (advice only, no drug suggestions).
+    """
+    return SymptomSnapshot(
+        versions=(0, 0),
+        keywords=tuple((name, tuple(kws)) for name, kws in SEED_KEYWORDS.items()),
+        contexts=MappingProxyType({name: build_context(name, [], None) for name in SEED_KEYWORDS}),
+        scopes=MappingProxyType({name: ("symptom", name) for name in SEED_KEYWORDS}),
+    )
+
+
+class SymptomKB:
+    """
+    Holds the current snapshot. Readers just read `current` (a single
+    attribute load, no locks, no DB); reloads build a complete new snapshot
+    and swap the reference, so a reader never sees a half-built one.
+    """
+    def __init__(self, reload_interval: float = RELOAD_INTERVAL_S):
+        self.reload_interval = reload_interval
+        self._snapshot: Optional[SymptomSnapshot] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def current(self) -> SymptomSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.reload()
+            snapshot = self._snapshot
+        return snapshot
+
+    def reload(self) -> bool:
+        with self._lock:
+            try:
+                snapshot = load_snapshot()
+            except Exception as e:
+                logger.warning("symptom KB load failed: %s", e)
+                if self._snapshot is None:
+                    self._snapshot = seed_snapshot()
+                return False
+            self._snapshot = snapshot
+        logger.info("symptom KB loaded", extra={"symptoms": len(snapshot.keywords),
+                                                "versions": str(snapshot.versions)})
+        return True
+
+    def refresh_if_changed(self) -> bool:
+        """
+        Cheap version check; rebuilds only when the mappings or meds changed.
+        """
+        try:
+            versions = get_versions()
+        except Exception as e:
+            logger.warning("symptom KB version check failed: %s", e)
+            return False
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.versions == versions:
+            return False
+        return self.reload()
+
+    def start_auto_reload(self):
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(self.reload_interval)
+                self.refresh_if_changed()
+
+        self._thread = threading.Thread(target=loop, name="symptom-kb-reload", daemon=True)
+        self._thread.start()
+
+
+kb = SymptomKB()
+
+
+# -------------------------------
+# MAIN
+# -------------------------------
+if __name__ == "__main__":
+    create_symptom_tables()
+    seed_symptom_kb()
+    snapshot = load_snapshot()
+    for symptom, _ in snapshot.keywords:
+        print(f"--- {symptom} {snapshot.scopes[symptom]}")
+        print(snapshot.contexts[symptom])
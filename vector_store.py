@@ -1,9 +1,10 @@
 # vector_store_db.py (simplified to work only with meds DB)
-from typing import List, Dict, Any
-from db import search_drug  # Function that queries the meds table in PostgreSQL
+from typing import List, Dict, Any, Optional
+from db import get_embeddings  # Query embeddings (same model as the stored chunk embeddings)
+from chunk_store import store as chunk_store, select_fields  # Precomputed per-drug / per-field chunks
 
 # ---------- General settings ----------
-TOP_K = 5  # Number of results to return (placeholder, here we always return 1)
+TOP_K = 5  # Number of results to return
 
 class RetrievedChunk:
     """
@@ -15,36 +16,31 @@ class RetrievedChunk:
         self.content = content
         self.source = source
 
-def query_similar(drug_name: str, top_k: int = TOP_K) -> List[Dict[str, Any]]:
+def query_similar(drug_name: str, top_k: int = TOP_K, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     """
-    Replacement for a vector store similarity query.
-    Instead of embeddings search, it fetches drug data directly from the meds table.
+    Similarity query over the precomputed chunk store.
+    - Known drug name / generic name, or a question naming one drug: that drug's
+      chunks, score 1.0. Only `fields` if given, else the fields the question
+      asks about (select_fields), else the summary chunk
+    - Anything else: cosine search over every per-drug and per-field chunk embedding
     Returns a list of dicts similar to what a vector DB would return.
     """
-    data = search_drug(drug_name)
-    if not data:
-        return []
-
-    # Format drug data into a readable text block
-    chunk_text = (
-        f"Drug Name: {data['drug_name']}\n"
-        f"Generic: {data['generic_name']}\n"
-        f"Class: {data['drug_class']}\n"
-        f"Indication: {data['indication']}\n"
-        f"Status After Sleeve: {data['status_after_sleeve']}\n"
-        f"Reason: {data['reason']}\n"
-        f"Dose Adjustment: {data['dose_adjustment_notes']}\n"
-        f"Form: {data['administration_form']}\n"
-        f"Notes: {data['notes']}\n"
-    )
+    if fields is None:
+        fields = select_fields(drug_name)
+    drug_id = chunk_store.resolve_drug(drug_name)
+    if drug_id is not None:
+        hits = [(c, 1.0) for c in chunk_store.drug_chunks(drug_id, fields)]
+    else:
+        hits = chunk_store.search(get_embeddings([drug_name])[0], top_k=top_k)
 
     # Return in vector-store-like format (id, content, metadata, score)
     return [{
-        "id": data["drug_name"],
-        "content": chunk_text,
-        "metadata": {"source": "SafeMeds DB"},
-        "score": None  # Score is not available since we are not using embeddings
-    }]
+        "id": chunk.id,
+        "content": chunk.text,
+        "metadata": {"source": "SafeMeds DB", "drug_id": chunk.drug_id, "field": chunk.field,
+                     "token_count": chunk.token_count},
+        "score": score,
+    } for chunk, score in hits[:top_k]]
 
 # ---------- Usage example ----------
 if __name__ == "__main__":
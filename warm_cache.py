@@ -0,0 +1,101 @@
+# warm_cache.py
+# Offline job: pre-generate answers for the standard intents of every drug.
+# Run: python warm_cache.py [--force]
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from backend import build_drug_context, build_prompt, call_gemini
+from db import create_answer_cache_table, get_answer_versions, list_drugs, save_cached_answer
+from logger import get_logger
+from rate_limit import TokenBucket
+from semantic_cache import context_fingerprint
+
+logger = get_logger(__name__)
+
+# ---------- General settings ----------
+CONCURRENCY = int(os.getenv("WARM_CACHE_CONCURRENCY", "4"))          # parallel Gemini calls
+REQUESTS_PER_MINUTE = float(os.getenv("WARM_CACHE_RPM", "60"))       # Gemini quota share for the job
+
+# The questions most users actually ask about a single drug
+INTENTS = {
+    "allowed": "ينفع اخد {drug_name} بعد التكميم؟",
+    "dose": "ايه الجرعة المناسبة من {drug_name} بعد التكميم؟",
+    "form": "{drug_name} بيتاخد ازاي؟ اقراص ولا شراب ولا ايه؟",
+    "why": "ليه ممكن اخد {drug_name}؟ وايه فايدته؟",
+}
+
+
+def answer_version(drug: dict, fingerprint: str) -> str:
+    """
+    Version stamp of an answer: the row's last_reviewed date plus a short hash
+    of the context it was generated from, so edits without a review bump
+    still count as changes.
+    """
+    return f"{drug.get('last_reviewed') or 'never'}:{fingerprint[:12]}"
+
+
+def plan_jobs(drugs, stored_versions, force: bool = False):
+    """
+    Yield (drug, intent, question, context, fingerprint, version) for every
+    answer that is missing or out of date.
+    """
+    for drug in drugs:
+        context = build_drug_context(drug)
+        fingerprint = context_fingerprint(context)
+        version = answer_version(drug, fingerprint)
+        for intent, template in INTENTS.items():
+            if not force and stored_versions.get((drug["id"], intent)) == version:
+                continue
+            question = template.format(drug_name=drug["drug_name"])
+            yield drug, intent, question, context, fingerprint, version
+
+
+def generate_one(limiter: TokenBucket, drug, intent, question, context, fingerprint, version) -> bool:
+    limiter.acquire()
+    answer, error = call_gemini(build_prompt(question, context))
+    if error:
+        logger.warning("warm cache generation failed", extra={"drug_id": drug["id"], "intent": intent,
+                                                             "error": error[:200]})
+        return False
+    # Saved one by one: the stored versions are the checkpoint for the next run
+    save_cached_answer(drug["id"], intent, question, answer, fingerprint, version)
+    return True
+
+
+def warm_cache(force: bool = False) -> dict:
+    """
+    Regenerate every (drug, intent) answer whose version changed since the last run.
+    Interrupted runs resume where they stopped, since finished answers are already stored.
+    """
+    create_answer_cache_table()
+    drugs = list_drugs()
+    jobs = list(plan_jobs(drugs, {} if force else get_answer_versions(), force=force))
+    print(f"📋 {len(drugs)} drugs, {len(jobs)} answers to (re)generate")
+
+    limiter = TokenBucket(rate=REQUESTS_PER_MINUTE / 60, capacity=CONCURRENCY)
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        futures = [pool.submit(generate_one, limiter, *job) for job in jobs]
+        for future in as_completed(futures):
+            try:
+                ok = future.result()
+            except Exception as e:
+                logger.error("warm cache job crashed: %s", e)
+                ok = False
+            if ok:
+                done += 1
+            else:
+                failed += 1
+            if (done + failed) % 20 == 0:
+                print(f"   ... {done + failed}/{len(jobs)}")
+
+    print(f"✅ Generated {done} answers, {failed} failed (will be retried next run)")
+    return {"drugs": len(drugs), "planned": len(jobs), "generated": done, "failed": failed}
+
+
+# -------------------------------
+# MAIN
+# -------------------------------
+if __name__ == "__main__":
+    warm_cache(force="--force" in sys.argv)
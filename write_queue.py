@@ -0,0 +1,204 @@
+# write_queue.py
+# Asynchronous add-drug path: enqueue now, insert in batches, embed later.
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from db import get_bulk_embeddings, insert_drugs, set_embeddings
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# ---------- General settings ----------
+FLUSH_MS = int(os.getenv("WRITE_QUEUE_FLUSH_MS", "200"))         # max time an insert waits for its batch
+MAX_BATCH = int(os.getenv("WRITE_QUEUE_MAX_BATCH", "100"))
+MAX_PENDING = int(os.getenv("WRITE_QUEUE_MAX_PENDING", "1000"))
+MAX_TRACKED = 10000   # ingest statuses kept for polling
+
+_STOP = object()
+
+
+class WriteQueueFull(RuntimeError):
+    """
+    Raised when too many add-drug requests are already pending.
+    """
+
+
+class DrugWriteQueue:
+    """
+    Accepts add-drug entries and returns an ingest id immediately.
+
+    A writer thread inserts queued entries in one transaction every
+    `flush_ms` (or every `max_batch` entries). An embedding thread then
+    encodes the inserted rows in batches and stores the vectors. The
+    `on_inserted` hooks run there too, once per committed batch whether or
+    not embedding succeeded, so in-memory caches/indexes always see the new
+    drugs; only the row vectors wait for a backfill.
+
+    Status per ingest id: queued -> inserted -> indexed, or duplicate / failed.
+
+    Queue and statuses live in this process's memory: run the API with a
+    single worker (uvicorn --workers 1), otherwise GET /drugs/ingest/{id}
+    returns 404 when the poll lands on a worker other than the one that
+    issued the id.
+    """
+    def __init__(self, flush_ms: int = FLUSH_MS, max_batch: int = MAX_BATCH, max_pending: int = MAX_PENDING):
+        self.flush = flush_ms / 1000
+        self.max_batch = max_batch
+        self._inserts: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._embeds: queue.Queue = queue.Queue()
+        self._status: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self.on_inserted: List[Callable[[List[dict]], None]] = []
+
+    # ---------- Public API ----------
+    def submit(self, entry: dict) -> str:
+        self._ensure_started()
+        ingest_id = uuid.uuid4().hex
+        self._set_status(ingest_id, status="queued", drug_name=entry.get("drug_name"), drug_id=None, error=None,
+                         queued_at=time.time())
+        try:
+            self._inserts.put_nowait((ingest_id, entry))
+        except queue.Full:
+            self._set_status(ingest_id, status="failed", error="write queue full")
+            raise WriteQueueFull(f"{self._inserts.qsize()} add-drug requests pending")
+        return ingest_id
+
+    def status(self, ingest_id: str) -> Optional[dict]:
+        with self._lock:
+            status = self._status.get(ingest_id)
+            return dict(status, ingest_id=ingest_id) if status else None
+
+    def stop(self):
+        """
+        Flush whatever is queued and stop both workers.
+        """
+        if not self._threads:
+            return
+        self._inserts.put(_STOP)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    # ---------- Workers ----------
+    def _ensure_started(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._threads = [
+                threading.Thread(target=self._write_loop, name="drug-writer", daemon=True),
+                threading.Thread(target=self._embed_loop, name="drug-embedder", daemon=True),
+            ]
+            for t in self._threads:
+                t.start()
+
+    def _drain(self, source: queue.Queue, first) -> tuple:
+        """
+        Collect items after `first` until the batch is full or the flush interval passes.
+        Returns (batch, stop_requested).
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.flush
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = source.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _write_loop(self):
+        stop = False
+        while not stop:
+            item = self._inserts.get()
+            if item is _STOP:
+                break
+            batch, stop = self._drain(self._inserts, item)
+            try:
+                results = insert_drugs([entry for _, entry in batch])
+            except Exception as e:
+                logger.error("drug insert batch failed: %s", e)
+                for ingest_id, _ in batch:
+                    self._set_status(ingest_id, status="failed", error=str(e))
+                continue
+            inserted = []
+            for (ingest_id, entry), (drug_id, error) in zip(batch, results):
+                if error is not None:
+                    logger.warning("drug insert failed", extra={"ingest_id": ingest_id, "error": error})
+                    self._set_status(ingest_id, status="failed", error=error)
+                elif drug_id is None:
+                    self._set_status(ingest_id, status="duplicate")
+                else:
+                    self._set_status(ingest_id, status="inserted", drug_id=drug_id)
+                    inserted.append((ingest_id, drug_id, entry))
+            logger.info("drug insert batch committed", extra={"batch": len(batch), "inserted": len(inserted)})
+            if inserted:
+                self._embeds.put(inserted)
+        self._embeds.put(_STOP)
+
+    def _embed_loop(self):
+        while True:
+            item = self._embeds.get()
+            if item is _STOP:
+                break
+            # Merge whatever insert batches piled up while the model was busy
+            rows = list(item)
+            stop = False
+            while not stop:
+                try:
+                    more = self._embeds.get_nowait()
+                except queue.Empty:
+                    break
+                if more is _STOP:
+                    stop = True
+                else:
+                    rows.extend(more)
+            self._index(rows)
+            if stop:
+                break
+
+    def _index(self, rows):
+        texts = [f"{e['drug_name']} ({e['generic_name']}) - {e['indication']}" for _, _, e in rows]
+        try:
+            embeddings = get_bulk_embeddings(texts)
+            set_embeddings([(drug_id, emb) for (_, drug_id, _), emb in zip(rows, embeddings)])
+            embed_error = None
+        except Exception as e:
+            # Rows are already committed; db.update_embeddings() can backfill later
+            logger.error("drug embedding batch failed: %s", e)
+            embed_error = e
+        # The rows exist either way: refresh caches / chunks / catalog version
+        entries = [dict(entry, id=drug_id) for _, drug_id, entry in rows]
+        for hook in self.on_inserted:
+            try:
+                hook(entries)
+            except Exception as e:
+                logger.error("on_inserted hook failed: %s", e)
+        for ingest_id, _, _ in rows:
+            if embed_error is None:
+                self._set_status(ingest_id, status="indexed")
+            else:
+                self._set_status(ingest_id, error=f"embedding pending: {embed_error}")
+
+    # ---------- Status bookkeeping ----------
+    def _set_status(self, ingest_id: str, **fields):
+        with self._lock:
+            status = self._status.setdefault(ingest_id, {})
+            status.update(fields)
+            status["updated_at"] = time.time()
+            self._status.move_to_end(ingest_id)
+            while len(self._status) > MAX_TRACKED:
+                self._status.popitem(last=False)
+
+
+write_queue = DrugWriteQueue()